@@ -0,0 +1,41 @@
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+from aio_pika.pool import Pool
+from loguru import logger
+
+
+class Broker:
+    """Asyncio AMQP client of lens.
+
+    Publishing goes through a small pool of channels with publisher confirms, consumers open their own channels
+    on the same robust connection, which reconnects and restores queues and consumers on failure.
+    """
+
+    def __init__(self, host: str, user: str, password: str, publisher_channels: int = 4):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.publisher_channels = publisher_channels
+        self.connection: AbstractRobustConnection = None
+        self._publishers: Pool[AbstractChannel] = None
+
+    async def connect(self) -> None:
+        self.connection = await aio_pika.connect_robust(host=self.host, login=self.user, password=self.password)
+        self._publishers = Pool(self._open_publisher, max_size=self.publisher_channels)
+        logger.info("Connected to RabbitMQ")
+
+    async def _open_publisher(self) -> AbstractChannel:
+        return await self.connection.channel(publisher_confirms=True)
+
+    async def channel(self) -> AbstractChannel:
+        """Open a dedicated (consumer or setup) channel, separate from the publisher pool."""
+        return await self.connection.channel()
+
+    async def publish(self, routing_key: str, body: bytes, **properties) -> None:
+        """Publish on the default exchange and wait for the broker to confirm the message."""
+        async with self._publishers.acquire() as channel:
+            await channel.default_exchange.publish(aio_pika.Message(body, **properties), routing_key=routing_key)
+
+    async def close(self) -> None:
+        await self._publishers.close()
+        await self.connection.close()
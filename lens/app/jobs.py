@@ -0,0 +1,82 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+
+# A job is queued, then goes through the processing stages it reports until it is done or failed
+FINISHED = ("done", "failed")
+
+
+class Job:
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+        self.status = "queued"
+        self.created = time.time()
+        self.updated = self.created
+        self.result = None
+        self.media_type = None
+        self.runner = None
+        self.subscribers: list[asyncio.Queue] = []
+
+    def describe(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created": self.created,
+            "updated": self.updated,
+        }
+
+
+class JobStore:
+    """Jobs of this lens instance, kept in memory until `ttl` seconds after they finish."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._jobs: dict[str, Job] = {}
+        # (expiry time, job id) of the finished jobs, in finishing order and so in expiry order
+        self._expiries = deque()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def create(self) -> Job:
+        self._expire()
+        job = Job()
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str):
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def update(self, job: Job, status: str) -> None:
+        job.status = status
+        job.updated = time.time()
+        for queue in job.subscribers:
+            queue.put_nowait(job.describe())
+
+    def finish(self, job: Job, result, media_type: str = None) -> None:
+        """Store the result of a job, None marks it as failed."""
+        job.result = result
+        job.media_type = media_type
+        self.update(job, "failed" if result is None else "done")
+        self._expiries.append((job.updated + self.ttl, job.id))
+
+    async def events(self, job: Job):
+        """Yield the description of a job now and at every status change, until it is finished."""
+        queue = asyncio.Queue()
+        job.subscribers.append(queue)
+        try:
+            state = job.describe()
+            while True:
+                yield state
+                if state["status"] in FINISHED:
+                    return
+                state = await queue.get()
+        finally:
+            job.subscribers.remove(queue)
+
+    def _expire(self) -> None:
+        now = time.time()
+        while self._expiries and self._expiries[0][0] <= now:
+            self._jobs.pop(self._expiries.popleft()[1], None)
@@ -1,6 +1,6 @@
 import os
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from opentelemetry import metrics
 from opentelemetry.exporter.prometheus import PrometheusMetricReader
 from opentelemetry.metrics import set_meter_provider
@@ -12,19 +12,27 @@ from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.trace import get_tracer_provider, set_tracer_provider
 from prometheus_client import start_http_server
-import cv2
 import asyncio
-from PIL import Image, ImageFont
+from PIL import Image, ImageOps
 from io import BytesIO
-from utils import draw_results
-import pika
+from typing import Literal
+from utils import OUTPUT_FORMATS, draw_results, encode_image, load_font
+from routing import FutureRegistry, ResultRouter
+from broker import Broker
+from jobs import JobStore
+from functools import partial
+import aio_pika
 import json
 import uuid
-import base64
 from loguru import logger
 from time import time
 
 WAIT_TIME = 300
+FONT_PATH = os.path.join(os.path.dirname(__file__), "BeVietnam-Light.ttf")
+# Overall deadline of a /translate request, covering both the OCR and the translation stage
+REQUEST_TIMEOUT = float(os.getenv("LENS_REQUEST_TIMEOUT", 2 * WAIT_TIME))
+# Finished jobs of the job API are kept for LENS_JOB_TTL seconds
+LENS_JOB_TTL = float(os.getenv("LENS_JOB_TTL", 600))
 
 
 METRIC_SERVICE_NAME = os.getenv("METRIC_SERVICE_NAME")
@@ -63,87 +71,128 @@ get_tracer_provider().add_span_processor(span_processor)
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-queue_connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=credentials, heartbeat=6000
-    )
-)
-logger.info("Connected to RabbitMQ")
-channel = queue_connection.channel()
-# Queue for OCR
-channel.exchange_declare(exchange="ocr-dlx", exchange_type="direct")
-channel.queue_declare(queue="ocr_tasks_dlq", durable=True)
-channel.queue_bind(exchange="ocr-dlx", queue="ocr_tasks_dlq")
-channel.queue_declare(
-    queue="ocr_tasks",
-    durable=True,
-    arguments={
-        "x-dead-letter-exchange": "ocr-dlx",
-        "x-dead-letter-routing-key": "ocr_tasks_dlq",
-        "x-message-ttl": 300000,  # 5 minutes in milliseconds
-    },
+LENS_PUBLISHER_CHANNELS = int(os.getenv("LENS_PUBLISHER_CHANNELS", 4))
+broker = Broker(
+    RABBITMQ_HOST,
+    RABBITMQ_USER,
+    RABBITMQ_PASSWORD,
+    publisher_channels=LENS_PUBLISHER_CHANNELS,
 )
-channel.queue_declare(queue="ocr_results", durable=True)
-
-# Queue for Translation
-channel.exchange_declare(exchange="trans-dlx", exchange_type="direct")
-channel.queue_declare(queue="translation_tasks_dlq", durable=True)
-channel.queue_bind(exchange="trans-dlx", queue="translation_tasks_dlq")
-channel.queue_declare(
-    queue="translation_tasks",
-    durable=True,
-    arguments={
-        "x-dead-letter-exchange": "trans-dlx",
-        "x-dead-letter-routing-key": "translation_tasks_dlq",
-        "x-message-ttl": 300000,  # 5 minutes in milliseconds
-    },
-)
-channel.queue_declare(queue="translation_results", durable=True)
+ocr_router = ResultRouter("ocr")
+translation_router = ResultRouter("translation")
+
+
+async def declare_queues(channel):
+    # Queue for OCR
+    ocr_dlx = await channel.declare_exchange("ocr-dlx", aio_pika.ExchangeType.DIRECT)
+    ocr_dlq = await channel.declare_queue("ocr_tasks_dlq", durable=True)
+    await ocr_dlq.bind(ocr_dlx, routing_key="ocr_tasks_dlq")
+    await channel.declare_queue(
+        "ocr_tasks",
+        durable=True,
+        arguments={
+            "x-dead-letter-exchange": "ocr-dlx",
+            "x-dead-letter-routing-key": "ocr_tasks_dlq",
+            "x-message-ttl": 300000,  # 5 minutes in milliseconds
+        },
+    )
+    await channel.declare_queue("ocr_results", durable=True)
+    # Text regions, between the detection and recognition stages of a two-stage OCR deployment
+    await channel.declare_queue(
+        "ocr_regions",
+        durable=True,
+        arguments={
+            "x-dead-letter-exchange": "ocr-dlx",
+            "x-dead-letter-routing-key": "ocr_tasks_dlq",
+            "x-message-ttl": 300000,  # 5 minutes in milliseconds
+        },
+    )
+
+    # Queue for Translation
+    trans_dlx = await channel.declare_exchange(
+        "trans-dlx", aio_pika.ExchangeType.DIRECT
+    )
+    trans_dlq = await channel.declare_queue("translation_tasks_dlq", durable=True)
+    await trans_dlq.bind(trans_dlx, routing_key="translation_tasks_dlq")
+    await channel.declare_queue(
+        "translation_tasks",
+        durable=True,
+        arguments={
+            "x-dead-letter-exchange": "trans-dlx",
+            "x-dead-letter-routing-key": "translation_tasks_dlq",
+            "x-message-ttl": 300000,  # 5 minutes in milliseconds
+        },
+    )
+    await channel.declare_queue("translation_results", durable=True)
+
 
 app = FastAPI()
 
-task_results = {}
-task_start_time = {}
+tasks = FutureRegistry()
+jobs = JobStore(LENS_JOB_TTL)
+
+
+@app.on_event("startup")
+async def connect_broker():
+    await broker.connect()
+    setup_channel = await broker.channel()
+    await declare_queues(setup_channel)
+    await setup_channel.close()
+    # Each result consumer gets its own channel, separate from the publisher pool
+    await ocr_router.start(await broker.channel())
+    await translation_router.start(await broker.channel())
+
 
+@app.on_event("shutdown")
+async def close_broker():
+    await broker.close()
 
-async def process_image(data: bytes, task_id: str) -> None:
+
+async def process_image(
+    data: bytes,
+    task_id: str,
+    content_type: str,
+    output: str,
+    output_format: str,
+    quality: int,
+    progress=None,
+) -> None:
     with tracer.start_as_current_span("process_image") as span:
         # Wait for OCR result
         logger.info("Sending OCR task")
         with tracer.start_as_current_span(
             "send_ocr_task", links=[trace.Link(span.get_span_context())]
         ):
-            channel.basic_publish(
-                exchange="",
-                routing_key="ocr_tasks",
-                body=json.dumps(
-                    {"task_id": task_id, "data": base64.b64encode(data).decode("utf-8")}
-                ),
-            )
+            # Only the image header is parsed here, the pixels are decoded by the OCR worker
+            width, height = Image.open(BytesIO(data)).size
+            ocr_router.register(task_id)
+            try:
+                await broker.publish(
+                    "ocr_tasks",
+                    data,
+                    correlation_id=task_id,
+                    reply_to=ocr_router.reply_queue,
+                    content_type=content_type,
+                    headers={"task_id": task_id, "width": width, "height": height},
+                )
+            except BaseException:
+                # wait() is never reached, it is what pops registered tasks otherwise
+                ocr_router.discard(task_id)
+                raise
 
         # Wait for OCR result
         logger.info("Waiting for OCR result")
         with tracer.start_as_current_span(
             "wait_ocr_result", links=[trace.Link(span.get_span_context())]
         ):
-            wait_count = 0
             ocr_ok = True
-            while True:
-                method_frame, _, body = channel.basic_get("ocr_results")
-                if method_frame:
-                    ocr_result = json.loads(body)
-                    if ocr_result["task_id"] == task_id:
-                        ocr_result = ocr_result["result"]
-                        channel.basic_ack(method_frame.delivery_tag)
-                        break
-                else:
-                    wait_count += 1
-                    if wait_count > WAIT_TIME:
-                        logger.error(f"OCR task {task_id} timeout")
-                        ocr_ok = False
-                        break
-                    await asyncio.sleep(1)
+            try:
+                ocr_result = await ocr_router.wait(task_id, WAIT_TIME)
+            except asyncio.TimeoutError:
+                logger.error(f"OCR task {task_id} timeout")
+                ocr_ok = False
+            if ocr_ok and progress:
+                progress("ocr_done")
 
         # Translation
         if ocr_ok:
@@ -151,57 +200,71 @@ async def process_image(data: bytes, task_id: str) -> None:
             with tracer.start_as_current_span(
                 "send_translation_task", links=[trace.Link(span.get_span_context())]
             ):
-                channel.basic_publish(
-                    exchange="",
-                    routing_key="translation_tasks",
-                    body=json.dumps({"task_id": task_id, "texts": ocr_result["texts"]}),
-                )
+                translation_router.register(task_id)
+                try:
+                    await broker.publish(
+                        "translation_tasks",
+                        json.dumps({"task_id": task_id, "texts": ocr_result["texts"]}).encode(
+                            "utf-8"
+                        ),
+                        correlation_id=task_id,
+                        reply_to=translation_router.reply_queue,
+                    )
+                except BaseException:
+                    translation_router.discard(task_id)
+                    raise
 
             # Wait for translation result
             logger.info("Waiting for translation result")
             with tracer.start_as_current_span(
                 "wait_translation_result", links=[trace.Link(span.get_span_context())]
             ):
-                wait_count = 0
                 translation_ok = True
-                while True:
-                    method_frame, _, body = channel.basic_get("translation_results")
-                    if method_frame:
-                        translation_result = json.loads(body)
-                        if translation_result["task_id"] == task_id:
-                            translation_result = translation_result["result"]
-                            channel.basic_ack(method_frame.delivery_tag)
-                            break
-                    else:
-                        wait_count += 1
-                        if wait_count > WAIT_TIME:
-                            logger.error(f"Translation task {task_id} timeout")
-                            translation_ok = False
-                            break
-                        await asyncio.sleep(1)
+                try:
+                    translation_result = await translation_router.wait(
+                        task_id, WAIT_TIME
+                    )
+                except asyncio.TimeoutError:
+                    logger.error(f"Translation task {task_id} timeout")
+                    translation_ok = False
+                if translation_ok and progress:
+                    progress("translated")
 
+        # Structured results come straight from the workers, nothing is drawn or encoded
+        if ocr_ok and translation_ok and output == "json":
+            tasks.resolve(
+                task_id,
+                {
+                    "bboxes": ocr_result["bboxes"],
+                    "texts": ocr_result["texts"],
+                    "translations": translation_result,
+                    "bbox_height": ocr_result["bbox_height"],
+                },
+            )
         # find suitable font size
-        if ocr_ok and translation_ok:
+        elif ocr_ok and translation_ok:
             logger.info("Formatting results")
             with tracer.start_as_current_span(
                 "format_results", links=[trace.Link(span.get_span_context())]
             ):
                 font_size = int(ocr_result["bbox_height"] / 1.5)
-                # Lens
-                fontpath = os.path.join(
-                    os.path.dirname(__file__), "./BeVietnam-Light.ttf"
-                )
-                font = ImageFont.truetype(fontpath, font_size)
-                image = Image.open(BytesIO(data))
+                font = load_font(FONT_PATH, font_size)
+                # Upright like the image the OCR worker ran on, so the boxes line up
+                image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
                 lens_result = draw_results(
                     image, ocr_result["bboxes"], translation_result, font
                 )
 
-            # Encode to bytes
-            buffer = cv2.imencode(".jpg", lens_result)[1].tobytes()
-            task_results[task_id] = buffer
+            # Encode straight from the drawn PIL image, the buffer is streamed as is
+            with tracer.start_as_current_span(
+                "encode_result", links=[trace.Link(span.get_span_context())]
+            ):
+                buffer = encode_image(lens_result, output_format, quality)
+            if progress:
+                progress("rendered")
+            tasks.resolve(task_id, buffer)
         else:
-            task_results[task_id] = None
+            tasks.resolve(task_id, None)
 
 
 @app.get("/healthcheck")
@@ -209,34 +272,140 @@ async def healthcheck():
     return {"status": "ok"}
 
 
+async def run_task(
+    data: bytes,
+    task_id: str,
+    content_type: str,
+    output: str,
+    output_format: str,
+    quality: int,
+    api: str,
+    progress=None,
+):
+    """Process an image within REQUEST_TIMEOUT, returns the result or None when processing failed."""
+    logger.info(f"Processing image: {task_id}")
+    start_time = time()
+    tasks.register(task_id)
+    processing = asyncio.create_task(
+        process_image(data, task_id, content_type, output, output_format, quality, progress)
+    )
+
+    def on_done(processing):
+        if not processing.cancelled() and processing.exception() is not None:
+            logger.opt(exception=processing.exception()).error(f"Processing of task {task_id} failed")
+        # Unblock the request right away if processing crashes before publishing a result
+        tasks.resolve(task_id, None)
+
+    processing.add_done_callback(on_done)
+
+    try:
+        result = await tasks.wait(task_id, REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"Task {task_id} exceeded the {REQUEST_TIMEOUT}s deadline")
+        processing.cancel()
+        result = None
+
+    logger.info(f"Sending result: {task_id}")
+    histogram.record(time() - start_time, {"api": api})
+    counter.add(1, {"api": api})
+    return result
+
+
 @app.post("/translate")
-async def translate(file: UploadFile = File(...)):
-    task_id = str(uuid.uuid4())
+async def translate(
+    file: UploadFile = File(...),
+    output: Literal["image", "json"] = "image",
+    format: Literal["jpeg", "webp", "png"] = "jpeg",
+    quality: int = Query(95, ge=1, le=100),
+):
     data = await file.read()
+    result = await run_task(
+        data, str(uuid.uuid4()), file.content_type, output, format, quality, "/lens"
+    )
+    if result is None:
+        return {"error": "Error"}
+    if output == "json":
+        return result
+    return StreamingResponse(result, media_type=OUTPUT_FORMATS[format][1])
 
-    logger.info(f"Processing image: {task_id}")
-    task_start_time[task_id] = time()
-    asyncio.create_task(process_image(data, task_id))
 
-    try:
-        while True:
-            if task_id in task_results:
-                logger.info(f"Sending result: {task_id}")
-                result = task_results[task_id]
-                if result is not None:
-                    histogram.record(
-                        time() - task_start_time[task_id], {"api": "/lens"}
-                    )
-                    counter.add(1, {"api": "/lens"})
-                    task_start_time.pop(task_id)
-                    return StreamingResponse(BytesIO(result), media_type="image/jpeg")
-                else:
-                    histogram.record(
-                        time() - task_start_time[task_id], {"api": "/lens"}
-                    )
-                    counter.add(1, {"api": "/lens"})
-                    task_start_time.pop(task_id)
-                    return {"error": "Error"}
-            await asyncio.sleep(1)
-    finally:
-        task_results.pop(task_id, None)
+async def run_job(job, data, content_type, output, output_format, quality):
+    result = await run_task(
+        data,
+        job.id,
+        content_type,
+        output,
+        output_format,
+        quality,
+        "/jobs",
+        partial(jobs.update, job),
+    )
+    if output == "json":
+        jobs.finish(job, result, "application/json")
+    else:
+        # Kept as bytes, the result can be downloaded until the job expires
+        jobs.finish(job, None if result is None else result.getvalue(), OUTPUT_FORMATS[output_format][1])
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    output: Literal["image", "json"] = "image",
+    format: Literal["jpeg", "webp", "png"] = "jpeg",
+    quality: int = Query(95, ge=1, le=100),
+):
+    """Start processing an image and return its job right away.
+
+    The job goes through the ocr_done, translated and (for images) rendered statuses, then ends done or failed.
+    Jobs live in the memory of the lens instance that accepted them.
+    """
+    data = await file.read()
+    job = jobs.create()
+    job.runner = asyncio.create_task(
+        run_job(job, data, file.content_type, output, format, quality)
+    )
+    return job.describe()
+
+
+def unknown_job():
+    return JSONResponse({"error": "Unknown or expired job"}, status_code=404)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return unknown_job()
+    description = job.describe()
+    if job.status == "done":
+        if job.media_type == "application/json":
+            description["result"] = job.result
+        else:
+            description["result_url"] = f"/jobs/{job.id}/result"
+    return description
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return unknown_job()
+    if job.status != "done":
+        return JSONResponse({"error": f"Job is {job.status}"}, status_code=409)
+    if job.media_type == "application/json":
+        return job.result
+    return Response(job.result, media_type=job.media_type)
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    """Server-sent events with the status of the job, until it is finished."""
+    job = jobs.get(job_id)
+    if job is None:
+        return unknown_job()
+
+    async def events():
+        async for state in jobs.events(job):
+            yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
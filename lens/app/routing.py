@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+from loguru import logger
+
+
+class FutureRegistry:
+    """Futures keyed by task id, resolved by whoever produces the result and awaited by whoever needs it."""
+
+    def __init__(self):
+        self._pending: dict[str, asyncio.Future] = {}
+
+    def register(self, key: str) -> asyncio.Future:
+        """Must be called before the work is started, otherwise a fast result could be dropped."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        return future
+
+    def resolve(self, key: str, value) -> bool:
+        future = self._pending.get(key)
+        if future is None:
+            return False
+        if not future.done():
+            future.set_result(value)
+        return True
+
+    def discard(self, key: str) -> None:
+        """Forget a key whose result will never be awaited, e.g. when the work could not be started."""
+        self._pending.pop(key, None)
+
+    async def wait(self, key: str, timeout: float):
+        try:
+            return await asyncio.wait_for(self._pending[key], timeout)
+        finally:
+            self._pending.pop(key, None)
+
+
+class ResultRouter(FutureRegistry):
+    """Route worker results back to the request waiting for them.
+
+    A consumer on a private reply queue resolves the future registered for the message correlation id, so
+    concurrent requests never see each other's results.
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self.reply_queue = None
+
+    async def start(self, channel: AbstractChannel) -> None:
+        # Exclusive server-named queue: results only ever come back to the pod that asked for them
+        queue = await channel.declare_queue(exclusive=True)
+        self.reply_queue = queue.name
+        await queue.consume(self._on_message, no_ack=True)
+        logger.info(f"Listening for {self.name} results on {self.reply_queue}")
+
+    async def _on_message(self, message: AbstractIncomingMessage) -> None:
+        if not self.resolve(message.correlation_id, json.loads(message.body)["result"]):
+            logger.warning(f"Dropping {self.name} result for unknown task {message.correlation_id}")
@@ -1,39 +1,125 @@
-import numpy as np
 from PIL import Image, ImageDraw, ImageFont
-import textwrap
+from functools import lru_cache
+from io import BytesIO
+
+# Font sizes follow the text height of each image, keep the fonts of the most recent sizes loaded
+FONT_CACHE_SIZE = 64
+# Widths of the words measured at each font size, the same words come back across boxes and requests
+WIDTH_CACHE_SIZE = 16384
+MIN_FONT_SIZE = 8
+# Space between a box border and its text
+PADDING = 2
+# Output formats: Pillow format and media type
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def line_height(path: str, size: int) -> int:
+    ascent, descent = load_font(path, size).getmetrics()
+    return ascent + descent
+
+
+@lru_cache(maxsize=WIDTH_CACHE_SIZE)
+def text_width(path: str, size: int, text: str) -> float:
+    return load_font(path, size).getlength(text)
+
+
+def wrap(words: list[str], path: str, size: int, width: float, strict: bool = True):
+    """Greedily wrap words into lines of at most `width` pixels.
+
+    Returns None when a single word is wider than `width`, unless not `strict` where it gets a line of its own.
+    """
+    space = text_width(path, size, " ")
+    lines = []
+    line = []
+    line_width = 0.0
+    for word in words:
+        word_width = text_width(path, size, word)
+        if word_width > width and strict:
+            return None
+        if line and line_width + space + word_width > width:
+            lines.append(" ".join(line))
+            line = [word]
+            line_width = word_width
+        else:
+            line_width += word_width + (space if line else 0)
+            line.append(word)
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def fit_text(text: str, width: float, height: float, path: str, max_size: int) -> tuple[int, list[str]]:
+    """Find the largest font size up to `max_size` at which `text` wraps into a `width` x `height` box.
+
+    Sizes are binary searched, a smaller size never needs more lines. Returns the size and the wrapped lines,
+    text that does not fit even at MIN_FONT_SIZE is cut to the lines the box can hold.
+    """
+    words = text.split()
+    low, high = MIN_FONT_SIZE, max(MIN_FONT_SIZE, max_size)
+    best = None
+    while low <= high:
+        size = (low + high) // 2
+        lines = wrap(words, path, size, width)
+        if lines is not None and len(lines) * line_height(path, size) <= height:
+            best = size, lines
+            low = size + 1
+        else:
+            high = size - 1
+    if best is not None:
+        return best
+    lines = wrap(words, path, MIN_FONT_SIZE, width, strict=False)
+    return MIN_FONT_SIZE, lines[: max(1, int(height // line_height(path, MIN_FONT_SIZE)))]
 
 
 def draw_results(
     img_pil: Image.Image, bboxes: list[list[int]], texts: list[str], font: ImageFont
-) -> np.ndarray:
-    current_y = 0
+) -> Image.Image:
+    """Draw each text over its box, in the largest size up to `font.size` at which it fits inside the box.
+
+    The image is drawn on in place and returned.
+    """
     draw = ImageDraw.Draw(img_pil)
-    for i in range(len(bboxes)):
-        (top_left, _, bottom_right, _) = bboxes[i]
-        top_left = [int(top_left[0]), int(top_left[1])]
-        bottom_right = [int(bottom_right[0]), int(bottom_right[1])]
-        width = bottom_right[0] - top_left[0]
-        height = bottom_right[1] - top_left[1]
-        top_left[1] = max(top_left[1], current_y)
-        bottom_right[1] = max(top_left[1] + height, current_y + height)
-        top_left = tuple(top_left)
-        bottom_right = tuple(bottom_right)
-        text = texts[i]
-
-        # Calculate max characters per line based on rectangle width
-        avg_char_width = font.getsize("x")[0]  # Get average character width
-        chars_per_line = max(1, int(width / avg_char_width))
-
-        # Wrap text to fit rectangle width
-        wrapped_text = textwrap.fill(text, width=chars_per_line)
+    for bbox, text in zip(bboxes, texts):
+        (top_left, _, bottom_right, _) = bbox
+        left, top = int(top_left[0]), int(top_left[1])
+        right, bottom = int(bottom_right[0]), int(bottom_right[1])
+        size, lines = fit_text(
+            text, right - left - 2 * PADDING, bottom - top - 2 * PADDING, font.path, font.size
+        )
+        box_font = load_font(font.path, size)
+        height = line_height(font.path, size)
 
         # Create a draw on the original image using the predicted bboxes
-        draw.rectangle([top_left, bottom_right], outline="gray", fill="gray")
-        y = top_left[1] + 5
-        for line in wrapped_text.split("\n"):
-            draw.text((top_left[0] + 5, y), line, font=font, fill="white")
-            # Move to next line by adding line height
-            y += font.getsize(line)[1]
-        current_y = y
-    img = np.array(img_pil)
-    return img
+        draw.rectangle([(left, top), (right, bottom)], outline="gray", fill="gray")
+        y = top + PADDING
+        for line in lines:
+            draw.text((left + PADDING, y), line, font=box_font, fill="white")
+            y += height
+    return img_pil
+
+
+def encode_image(image: Image.Image, output_format: str = "jpeg", quality: int = 95) -> BytesIO:
+    """Encode an image straight from PIL into a buffer positioned at its start.
+
+    `quality` applies to JPEG and WebP, PNG is written with fast compression.
+    """
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, format=pil_format, compress_level=1)
+    else:
+        image.save(buffer, format=pil_format, quality=quality)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ResultCache:
+    """LRU cache of OCR results keyed by the SHA-256 of the image bytes.
+
+    The cache is bounded by the serialized size of the stored results and entries can expire after `ttl`
+    seconds (0 keeps them until evicted). A perceptual hash can be attached to an entry as a secondary index
+    for opt-in near-duplicate lookups. An optional `DiskCache` keeps results across restarts, exact misses
+    fall through to it and its hits are promoted back into memory.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0, disk: "DiskCache" = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self.size = 0
+        self.hits = 0
+        self.similar_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (result, size in bytes, expiry time, perceptual hash)
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._by_phash: dict[str, str] = {}
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        result = self._lookup(key)
+        if result is not None:
+            self.hits += 1
+            if self.disk is not None:
+                self.disk.touch(key)
+            return result
+        if self.disk is not None:
+            result = self.disk.get(key)
+            if result is not None:
+                self.disk_hits += 1
+                self.put(key, result, persist=False)
+                return result
+        self.misses += 1
+        return None
+
+    def get_similar(self, phash: str):
+        """Look up a result through the perceptual hash index after an exact miss.
+
+        The caller decides what makes two images similar enough by what it puts in `phash`.
+        """
+        key = self._by_phash.get(phash)
+        result = None if key is None else self._lookup(key)
+        if result is not None:
+            self.similar_hits += 1
+            if self.disk is not None:
+                self.disk.touch(key)
+        return result
+
+    def put(self, key: str, result, phash: str = None, persist: bool = True) -> None:
+        if persist and self.disk is not None:
+            self.disk.put(key, result, self.ttl)
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        self._entries[key] = (result, size, expires, phash)
+        self.size += size
+        if phash is not None:
+            self._by_phash[phash] = key
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def warm(self, entries: int) -> int:
+        """Load the most used results of the disk tier into memory, returns how many were loaded."""
+        if self.disk is None or not entries:
+            return 0
+        hottest = list(self.disk.hottest(entries))
+        # Insert the hottest last so that they are the last to be evicted
+        for key, result in reversed(hottest):
+            self.put(key, result, persist=False)
+        return len(hottest)
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] and entry[2] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _remove(self, key: str) -> None:
+        _, size, _, phash = self._entries.pop(key)
+        self.size -= size
+        if phash is not None and self._by_phash.get(phash) == key:
+            del self._by_phash[phash]
+
+
+class DiskCache:
+    """SQLite store of OCR results, bounded by the total size of the stored results.
+
+    When the budget is exceeded the least used results are deleted, the least recently used first among results
+    with as many hits. The hit count of every result is kept so that the hottest ones can be loaded back into
+    memory at startup. Hits served from memory are recorded with `touch` and written in batches, every
+    FLUSH_HITS hits or FLUSH_SECONDS seconds.
+    """
+
+    EVICTION_BATCH = 64
+    FLUSH_HITS = 256
+    FLUSH_SECONDS = 10.0
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        # key -> (hits, last access) not written yet
+        self._touched: dict[str, tuple[int, float]] = {}
+        self._touched_hits = 0
+        self._flushed = time.monotonic()
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, last_access REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_hits ON results (hits, last_access)")
+        # The total size is kept by triggers so that every process sharing the file enforces the same budget
+        with self._transaction():
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results "
+                "BEGIN UPDATE usage SET size = size + NEW.size; END"
+            )
+            self.db.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results "
+                "BEGIN UPDATE usage SET size = size - OLD.size; END"
+            )
+            self.db.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results "
+                "BEGIN UPDATE usage SET size = size + NEW.size - OLD.size; END"
+            )
+            self.db.execute("INSERT OR IGNORE INTO usage SELECT 0, COALESCE(SUM(size), 0) FROM results")
+        self.db.execute("DELETE FROM results WHERE expires > 0 AND expires < ?", (time.time(),))
+
+    @property
+    def size(self) -> int:
+        return self.db.execute("SELECT size FROM usage").fetchone()[0]
+
+    @contextmanager
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def get(self, key: str):
+        now = time.time()
+        row = self.db.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] and row[1] < now):
+            return None
+        self.db.execute("UPDATE results SET hits = hits + 1, last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def touch(self, key: str) -> None:
+        """Record a hit on a result served from memory."""
+        hits, _ = self._touched.get(key, (0, 0))
+        self._touched[key] = (hits + 1, time.time())
+        self._touched_hits += 1
+        if self._touched_hits >= self.FLUSH_HITS or time.monotonic() - self._flushed >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._touched:
+            self.db.executemany(
+                "UPDATE results SET hits = hits + ?, last_access = MAX(last_access, ?) WHERE key = ?",
+                [(hits, last_access, key) for key, (hits, last_access) in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touched_hits = 0
+        self._flushed = time.monotonic()
+
+    def put(self, key: str, result, ttl: float = 0) -> None:
+        value = json.dumps(result).encode("utf-8")
+        if len(value) > self.max_bytes:
+            return
+        # Evict by up to date access times
+        self.flush()
+        now = time.time()
+        # One write transaction: workers sharing the file check and evict against the same total
+        with self._transaction():
+            self.db.execute(
+                "INSERT INTO results (key, value, size, expires, hits, last_access) VALUES (?, ?, ?, ?, 0, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "expires = excluded.expires, last_access = excluded.last_access",
+                (key, value, len(value), now + ttl if ttl else 0, now),
+            )
+            excess = self.size - self.max_bytes
+            while excess > 0:
+                coldest = self.db.execute(
+                    "SELECT key, size FROM results ORDER BY hits, last_access LIMIT ?", (self.EVICTION_BATCH,)
+                ).fetchall()
+                if not coldest:
+                    break
+                evicted = []
+                for k, size in coldest:
+                    evicted.append((k,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self.db.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def hottest(self, limit: int):
+        self.flush()
+        rows = self.db.execute(
+            "SELECT key, value FROM results WHERE expires = 0 OR expires > ? "
+            "ORDER BY hits DESC, last_access DESC LIMIT ?",
+            (time.time(), limit),
+        )
+        for key, value in rows:
+            yield key, json.loads(value)
@@ -0,0 +1,171 @@
+import math
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+from loguru import logger
+
+DETECTOR_FILE = "craft.onnx"
+RECOGNIZER_FILE = "recognizer.onnx"
+# Height of the text crops fed to the recognizer
+RECOGNIZER_HEIGHT = 64
+
+
+class OcrEngine(ABC):
+    """Text detection and recognition backend of the OCR worker.
+
+    `readtext` returns the easyocr detection format: a list of (4 point bbox, text, probability) in the
+    coordinates of the given BGR or grayscale array. `readtext_batched` runs several arrays of the same shape.
+
+    The two stages can also run apart: `detect_regions` returns the (bbox, crop) text regions of an image and
+    `recognize_regions` reads regions of any number of images in batches, returning the detections.
+    """
+
+    @abstractmethod
+    def readtext(self, image: np.ndarray) -> list:
+        """Detect and read the text of one image."""
+
+    def readtext_batched(self, images: list[np.ndarray]) -> list[list]:
+        return [self.readtext(image) for image in images]
+
+    @abstractmethod
+    def detect_regions(self, image: np.ndarray) -> list:
+        """Return the (bbox, crop) text regions of one image."""
+
+    @abstractmethod
+    def recognize_regions(self, regions: list, batch_size: int) -> list:
+        """Read (bbox, crop) regions in batches of `batch_size` crops, in order."""
+
+
+class EasyOcrEngine(OcrEngine):
+    """easyocr with its PyTorch CRAFT detector and recognizer."""
+
+    def __init__(self, model_dir: str, quantize: bool = True):
+        import easyocr
+
+        self.reader = easyocr.Reader(
+            ["en"],
+            model_storage_directory=model_dir,
+            detect_network="craft",
+            gpu=False,
+            quantize=quantize,
+        )
+
+    def readtext(self, image):
+        return self.reader.readtext(image)
+
+    def readtext_batched(self, images):
+        return self.reader.readtext_batched(images)
+
+    def detect_regions(self, image):
+        from easyocr.utils import get_image_list, reformat_input
+
+        _, grey = reformat_input(image)
+        horizontal_list, free_list = self.reader.detect(image)
+        regions, _ = get_image_list(
+            horizontal_list[0], free_list[0], grey, model_height=RECOGNIZER_HEIGHT, sort_output=False
+        )
+        return [([[int(x), int(y)] for x, y in bbox], crop) for bbox, crop in regions]
+
+    def recognize_regions(self, regions, batch_size):
+        from easyocr.recognition import get_text
+
+        # On CPU readtext recognizes the crops one at a time. Crops of similar width are batched together
+        # instead, so that little of the batch is padding.
+        ignore_char = "".join(set(self.reader.character) - set(self.reader.lang_char))
+        ratios = [crop.shape[1] / crop.shape[0] for _, crop in regions]
+        order = sorted(range(len(regions)), key=ratios.__getitem__)
+        detections = [None] * len(regions)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            max_width = max(math.ceil(ratios[i]) for i in batch) * RECOGNIZER_HEIGHT
+            results = get_text(
+                self.reader.character,
+                RECOGNIZER_HEIGHT,
+                max_width,
+                self.reader.recognizer,
+                self.reader.converter,
+                [regions[i] for i in batch],
+                ignore_char,
+                batch_size=batch_size,
+                workers=0,
+                device=self.reader.device,
+            )
+            for i, detection in zip(batch, results):
+                detections[i] = detection
+        return detections
+
+
+class OnnxSession:
+    """ONNX export of one of the easyocr networks run on ONNX Runtime CPU, called like the network.
+
+    The session is created on the first call: ONNX Runtime starts its thread pool with the session, and that
+    pool would not survive the fork of the OCR workers. `wrap` converts the output arrays.
+    """
+
+    def __init__(self, path: str, num_threads: int = 0, wrap=None):
+        self.path = path
+        self.num_threads = num_threads
+        self.wrap = wrap
+        self.session = None
+
+    def __call__(self, *inputs):
+        if self.session is None:
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if self.num_threads:
+                options.intra_op_num_threads = self.num_threads
+            self.session = onnxruntime.InferenceSession(
+                self.path, options, providers=["CPUExecutionProvider"]
+            )
+        # The exporter drops the unused text input of the recognizer, so only feed the inputs the graph has
+        names = [node.name for node in self.session.get_inputs()]
+        outputs = self.session.run(None, dict(zip(names, inputs)))
+        if self.wrap is not None:
+            outputs = [self.wrap(output) for output in outputs]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+def onnx_module(path: str, num_threads: int = 0):
+    """PyTorch stand-in for one of the easyocr networks, running its ONNX export with an `OnnxSession`."""
+    import torch
+
+    class OnnxModule(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.session = OnnxSession(path, num_threads, wrap=torch.from_numpy)
+
+        def forward(self, *inputs):
+            return self.session(*(value.cpu().numpy() for value in inputs))
+
+    return OnnxModule()
+
+
+class OnnxOcrEngine(EasyOcrEngine):
+    """CRAFT detector and recognizer exported to ONNX (see export_onnx.py) and run on ONNX Runtime.
+
+    Image preparation, box grouping and CTC decoding stay those of easyocr, so both engines give the same
+    detections up to the numerical differences of the runtimes.
+    """
+
+    def __init__(self, model_dir: str, onnx_dir: str, num_threads: int = 0):
+        # Fail at startup rather than on the first task when the runtime is missing, sessions are created later
+        import onnxruntime  # noqa: F401
+
+        super().__init__(model_dir, quantize=False)
+        self.reader.detector = onnx_module(os.path.join(onnx_dir, DETECTOR_FILE), num_threads)
+        self.reader.recognizer = onnx_module(os.path.join(onnx_dir, RECOGNIZER_FILE), num_threads)
+
+
+ENGINES = {
+    "easyocr": EasyOcrEngine,
+    "onnx": OnnxOcrEngine,
+}
+
+
+def create_engine(name: str, **options) -> OcrEngine:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine {name!r}, expected one of {', '.join(ENGINES)}")
+    logger.info(f"Loading the {name} OCR engine")
+    return ENGINES[name](**options)
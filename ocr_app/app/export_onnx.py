@@ -0,0 +1,49 @@
+"""Export the easyocr CRAFT detector and English recognizer to ONNX for the onnx OCR engine.
+
+Usage: python export_onnx.py [output_dir]
+"""
+import os
+import sys
+
+import torch
+
+from engine import DETECTOR_FILE, RECOGNIZER_FILE, EasyOcrEngine
+
+
+def main():
+    model_dir = os.path.join(os.path.dirname(__file__), "models")
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(model_dir, "onnx")
+    os.makedirs(output_dir, exist_ok=True)
+    # Dynamically quantized PyTorch modules cannot be exported, start from the float32 ones
+    reader = EasyOcrEngine(model_dir, quantize=False).reader
+
+    torch.onnx.export(
+        reader.detector,
+        torch.randn(1, 3, 640, 640),
+        os.path.join(output_dir, DETECTOR_FILE),
+        input_names=["image"],
+        output_names=["scores", "features"],
+        dynamic_axes={
+            "image": {0: "batch", 2: "height", 3: "width"},
+            "scores": {0: "batch", 1: "height", 2: "width"},
+            "features": {0: "batch", 2: "height", 3: "width"},
+        },
+        opset_version=17,
+    )
+    torch.onnx.export(
+        reader.recognizer,
+        (torch.randn(1, 1, 64, 256), torch.zeros(1, 26, dtype=torch.long)),
+        os.path.join(output_dir, RECOGNIZER_FILE),
+        input_names=["image", "text"],
+        output_names=["predictions"],
+        dynamic_axes={
+            "image": {0: "batch", 3: "width"},
+            "predictions": {0: "batch", 1: "steps"},
+        },
+        opset_version=17,
+    )
+    print(f"Exported the OCR models to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
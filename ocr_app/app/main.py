@@ -1,30 +1,47 @@
-import easyocr
 import os
 from PIL import Image
 import imagehash
+from opentelemetry import metrics
+from opentelemetry.exporter.prometheus import PrometheusMetricReader
+from opentelemetry.metrics import CallbackOptions, Observation, set_meter_provider
+from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry import trace
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.trace import get_tracer_provider, set_tracer_provider
-from collections import OrderedDict
 from io import BytesIO
 import pika
 import json
 from loguru import logger
 import base64
+import time
+import multiprocessing
+import signal
 import numpy as np
 from utils import get_sentence
+from preprocess import normalize_image, rescale_detection
+from cache import DiskCache, ResultCache
+from supervisor import run_workers
+from engine import create_engine
+from tiling import merge_tiles, tile_grid
+from prometheus_client import start_http_server
+import torch
 
 
 METRIC_SERVICE_NAME = os.getenv("METRIC_SERVICE_NAME")
 METRIC_SERVICE_VERSION = os.getenv("METRIC_SERVICE_VERSION")
 
+resource = Resource(attributes={SERVICE_NAME: METRIC_SERVICE_NAME})
+metric_reader = PrometheusMetricReader()
+provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
+set_meter_provider(provider)
+meter = metrics.get_meter(METRIC_SERVICE_NAME, METRIC_SERVICE_VERSION)
+
 # Setup Jaeger
 JAEGER_AGENT_HOST = os.getenv("JAEGER_AGENT_HOST")
 JAEGER_AGENT_PORT = int(os.getenv("JAEGER_AGENT_PORT"))
-resource = Resource(attributes={SERVICE_NAME: METRIC_SERVICE_NAME})
 set_tracer_provider(TracerProvider(resource=resource))
 tracer = get_tracer_provider().get_tracer(METRIC_SERVICE_NAME, METRIC_SERVICE_VERSION)
 jaeger_exporter = JaegerExporter(
@@ -38,94 +55,475 @@ get_tracer_provider().add_span_processor(span_processor)
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-CACHE_SIZE = 100
-cache = OrderedDict()
+# OCR result cache, OCR_CACHE_PHASH also serves near-duplicate images of the same size from the cache
+OCR_CACHE_BYTES = int(os.getenv("OCR_CACHE_BYTES", 64 * 1024 * 1024))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", 0))
+OCR_CACHE_PHASH = os.getenv("OCR_CACHE_PHASH", "0") == "1"
+# Optional persistent tier on a local volume, the hottest results are loaded back into memory at startup
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR")
+OCR_CACHE_DISK_BYTES = int(os.getenv("OCR_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+OCR_CACHE_WARM_ENTRIES = int(os.getenv("OCR_CACHE_WARM_ENTRIES", 1000))
+# Pre-detection normalization, detections are mapped back to original image coordinates
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", 2048))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "0") == "1"
+OCR_SHARPEN = os.getenv("OCR_SHARPEN", "0") == "1"
+# OCR engine: easyocr (default) or onnx, which runs the ONNX export of the easyocr networks from OCR_ONNX_DIR
+OCR_ENGINE = os.getenv("OCR_ENGINE", "easyocr")
+OCR_ONNX_DIR = os.getenv("OCR_ONNX_DIR")
+# Pipeline stage: all runs OCR in one worker. detect publishes the text regions of each image to the ocr_regions
+# queue, where recognize workers read the regions of several images per batch of OCR_RECOGNITION_BATCH_SIZE crops.
+OCR_STAGE = os.getenv("OCR_STAGE", "all")
+OCR_RECOGNITION_BATCH_SIZE = int(os.getenv("OCR_RECOGNITION_BATCH_SIZE", 32))
+# Tiling: images whose long side exceeds OCR_TILE_THRESHOLD (0 disables tiling) are only downscaled to
+# OCR_TILE_MAX_SIDE, then read in OCR_TILE_SIZE tiles overlapping by OCR_TILE_OVERLAP pixels. Tiles are spread over
+# OCR_TILE_PROCESSES forked processes (0 reads them in the worker), each with OCR_TILE_THREADS torch threads.
+OCR_TILE_THRESHOLD = int(os.getenv("OCR_TILE_THRESHOLD", 0))
+OCR_TILE_MAX_SIDE = int(os.getenv("OCR_TILE_MAX_SIDE", 8192))
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", 1536))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", 256))
+OCR_TILE_PROCESSES = int(os.getenv("OCR_TILE_PROCESSES", 2))
+OCR_TILE_THREADS = int(os.getenv("OCR_TILE_THREADS", 1))
+# Images are decoded whole before tiling, JPEGs at the smallest scale above the target size and other formats at
+# full size, and normalization holds a few copies of the decoded image. Images of more than OCR_MAX_IMAGE_PIXELS
+# pixels are rejected before decoding, which bounds that memory. PIL's own limit is replaced by this one.
+OCR_MAX_IMAGE_PIXELS = int(os.getenv("OCR_MAX_IMAGE_PIXELS", 100_000_000))
+Image.MAX_IMAGE_PIXELS = None
+# Workers: OCR_WORKERS > 1 forks processes sharing the loaded model, each with OCR_THREADS_PER_WORKER torch threads
+# (0 lets torch use every core). With several workers the cores are split between them by default, so that the
+# node does not run OCR_WORKERS times more threads than it has cores. Worker i serves its metrics on port 8099 + i.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 1))
+OCR_THREADS_PER_WORKER = int(
+    os.getenv("OCR_THREADS_PER_WORKER", max(1, os.cpu_count() // OCR_WORKERS) if OCR_WORKERS > 1 else 0)
+)
+METRICS_PORT = 8099
+# Batching: up to OCR_BATCH_SIZE prefetched tasks, waiting at most OCR_BATCH_WAIT_MS to fill a batch
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", 1))
+OCR_BATCH_WAIT_MS = float(os.getenv("OCR_BATCH_WAIT_MS", 50))
+# Connections and caches are created per worker by serve()
+queue_connection = None
+channel = None
+cache = None
+tile_pool = None
 
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-queue_connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=credentials, heartbeat=6000
-    )
+
+def observe(attribute):
+    def callback(options: CallbackOptions):
+        yield Observation(getattr(cache, attribute))
+
+    return callback
+
+
+meter.create_observable_counter(
+    name="ocr_cache_hits", callbacks=[observe("hits")], description="OCR cache hits"
+)
+meter.create_observable_counter(
+    name="ocr_cache_similar_hits",
+    callbacks=[observe("similar_hits")],
+    description="OCR cache hits through the perceptual hash index",
+)
+meter.create_observable_counter(
+    name="ocr_cache_disk_hits",
+    callbacks=[observe("disk_hits")],
+    description="OCR cache hits served by the disk tier",
+)
+meter.create_observable_counter(
+    name="ocr_cache_misses",
+    callbacks=[observe("misses")],
+    description="OCR cache misses",
+)
+meter.create_observable_counter(
+    name="ocr_cache_evictions",
+    callbacks=[observe("evictions")],
+    description="OCR cache evictions",
+)
+meter.create_observable_gauge(
+    name="ocr_cache_size",
+    callbacks=[observe("size")],
+    description="Serialized size of the cached OCR results",
+    unit="bytes",
 )
-channel = queue_connection.channel()
-logger.info("OCR channel initialized")
 
 
 # Load model
 model_dir = os.path.join(os.path.dirname(__file__), "models")
-reader = easyocr.Reader(
-    ["en"],
-    model_storage_directory=model_dir,
-    detect_network="craft",
-    gpu=False,
-)
+if OCR_ENGINE == "onnx":
+    engine = create_engine(
+        OCR_ENGINE,
+        model_dir=model_dir,
+        onnx_dir=OCR_ONNX_DIR or os.path.join(model_dir, "onnx"),
+        num_threads=OCR_THREADS_PER_WORKER,
+    )
+else:
+    engine = create_engine(OCR_ENGINE, model_dir=model_dir)
 logger.info("OCR model loaded")
 
 
-def process_ocr_task(ch, method, properties, body):
-    try:
-        with tracer.start_as_current_span("ocr-service") as span:
-            with tracer.start_as_current_span(
-                "load_data", links=[trace.Link(span.get_span_context())]
-            ):
-                task = json.loads(body)
-                logger.info(f"Processing image: {task['task_id']}")
-                image = Image.open(
-                    BytesIO(base64.b64decode(task["data"].encode("utf-8")))
-                )
-                image_hash = imagehash.average_hash(image)
-
-            if image_hash in cache:
-                channel.basic_publish(
-                    exchange="",
-                    routing_key="ocr_results",
-                    body=json.dumps(
-                        {"task_id": task["task_id"], "result": cache[image_hash]}
-                    ),
-                )
-                channel.basic_ack(delivery_tag=method.delivery_tag)
-                return
+def publish_result(properties, task_id, result):
+    # Reply to the lens instance that sent the task, keyed by its correlation id
+    channel.basic_publish(
+        exchange="",
+        routing_key=properties.reply_to or "ocr_results",
+        properties=pika.BasicProperties(
+            correlation_id=properties.correlation_id or task_id
+        ),
+        body=json.dumps({"task_id": task_id, "result": result}),
+    )
 
-            with tracer.start_as_current_span(
-                "ocr_detection", links=[trace.Link(span.get_span_context())]
-            ):
-                detection = reader.readtext(image)
 
-            # Get median height of bboxes
-            with tracer.start_as_current_span(
-                "ocr_detection_height", links=[trace.Link(span.get_span_context())]
-            ):
-                bboxes_heights = []
-                for bbox, text, prob in detection:
-                    (top_left, _, bottom_right, _) = bbox
-                    bboxes_heights.append(bottom_right[1] - top_left[1])
-                bbox_height = int(np.median(bboxes_heights))
-
-            # Create the final result
+def load_task(properties, body):
+    """Return the task id and image bytes of an OCR task.
+
+    Lens sends the raw image bytes as the message body with the task id, content type and dimensions in the
+    headers. The legacy base64-in-JSON format is still accepted while older lens instances drain.
+    """
+    headers = properties.headers or {}
+    if "task_id" in headers:
+        return headers["task_id"], body
+    task = json.loads(body)
+    return task["task_id"], base64.b64decode(task["data"].encode("utf-8"))
+
+
+def prepare_task(method, properties, body, span):
+    """Decode a task and answer it from the cache when possible, otherwise return the job to run OCR on."""
+    with tracer.start_as_current_span(
+        "load_data", links=[trace.Link(span.get_span_context())]
+    ):
+        task_id, data = load_task(properties, body)
+        logger.info(f"Processing image: {task_id}")
+        # BytesIO shares the buffer of an immutable bytes body, the image is decoded without copying it
+        image = Image.open(BytesIO(data))
+        # Only the header has been read so far
+        if image.width * image.height > OCR_MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image of {image.width}x{image.height} pixels exceeds OCR_MAX_IMAGE_PIXELS")
+
+    with tracer.start_as_current_span(
+        "ocr_cache_lookup", links=[trace.Link(span.get_span_context())]
+    ):
+        cache_key = ResultCache.key(data)
+        cached = cache.get(cache_key)
+        phash = None
+        if cached is None and OCR_CACHE_PHASH:
+            phash = f"{imagehash.phash(image)}:{image.width}x{image.height}"
+            cached = cache.get_similar(phash)
+
+    if cached is not None:
+        publish_result(properties, task_id, cached)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        return None
+
+    with tracer.start_as_current_span(
+        "ocr_normalize", links=[trace.Link(span.get_span_context())]
+    ):
+        tiled = OCR_TILE_THRESHOLD > 0 and max(image.size) > OCR_TILE_THRESHOLD
+        array, scale_x, scale_y = normalize_image(
+            image, OCR_TILE_MAX_SIDE if tiled else OCR_MAX_SIDE, OCR_GRAYSCALE, OCR_SHARPEN
+        )
+
+    return {
+        "method": method,
+        "properties": properties,
+        "task_id": task_id,
+        "cache_key": cache_key,
+        "phash": phash,
+        "array": array,
+        "scale": (scale_x, scale_y),
+        "tiled": tiled,
+    }
+
+
+def init_tile_process():
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(OCR_TILE_THREADS)
+
+
+def read_tile(tile):
+    return engine.readtext(tile)
+
+
+def detect_tile_regions(tile):
+    return engine.detect_regions(tile)
+
+
+def run_tiled(array, function):
+    """Run `function` on overlapping tiles of an array and merge its (bbox, ...) results.
+
+    Only one tile at a time is copied to each tile process, so detection memory does not grow with the image.
+    The normalized array itself is bounded by OCR_TILE_MAX_SIDE.
+    """
+    height, width = array.shape[:2]
+    tiles = tile_grid(width, height, OCR_TILE_SIZE, OCR_TILE_OVERLAP)
+    crops = (np.ascontiguousarray(array[y:y + h, x:x + w]) for x, y, w, h in tiles)
+    if tile_pool is None:
+        results = [function(crop) for crop in crops]
+    else:
+        results = list(tile_pool.imap(function, crops))
+    return merge_tiles(tiles, results)
+
+
+def detect(jobs):
+    """Run OCR on a group of jobs whose normalized images have the same shape.
+
+    The engines only batch images of identical size, which is the common case for photos taken by the same
+    kind of device once they are normalized.
+    """
+    if len(jobs) == 1 and jobs[0]["tiled"]:
+        detections = [run_tiled(jobs[0]["array"], read_tile)]
+    elif len(jobs) == 1:
+        detections = [engine.readtext(jobs[0]["array"])]
+    else:
+        detections = engine.readtext_batched([job["array"] for job in jobs])
+    for job, detection in zip(jobs, detections):
+        job["detection"] = rescale_detection(detection, *job["scale"])
+
+
+def publish_regions(job, regions):
+    """Send the text regions of an image to the recognition stage, which answers the lens instance directly.
+
+    The grayscale crops are concatenated in the body, their boxes and shapes are in the headers.
+    """
+    properties = job["properties"]
+    channel.basic_publish(
+        exchange="",
+        routing_key="ocr_regions",
+        properties=pika.BasicProperties(
+            reply_to=properties.reply_to or "ocr_results",
+            correlation_id=properties.correlation_id or job["task_id"],
+            headers={
+                "task_id": job["task_id"],
+                "cache_key": job["cache_key"],
+                "phash": job["phash"],
+                "scale": json.dumps(job["scale"]),
+                "boxes": json.dumps([bbox for bbox, _ in regions]),
+                "shapes": json.dumps([crop.shape for _, crop in regions]),
+            },
+        ),
+        body=b"".join(np.ascontiguousarray(crop, dtype=np.uint8).tobytes() for _, crop in regions),
+    )
+    channel.basic_ack(delivery_tag=job["method"].delivery_tag)
+
+
+def load_regions(method, properties, body):
+    """Return the job and the (bbox, crop) text regions of a message of the detection stage."""
+    headers = properties.headers
+    regions = []
+    offset = 0
+    for bbox, shape in zip(json.loads(headers["boxes"]), json.loads(headers["shapes"])):
+        size = shape[0] * shape[1]
+        crop = np.frombuffer(body, dtype=np.uint8, count=size, offset=offset).reshape(shape)
+        regions.append((bbox, crop))
+        offset += size
+    job = {
+        "method": method,
+        "properties": properties,
+        "task_id": headers["task_id"],
+        "cache_key": headers["cache_key"],
+        "phash": headers["phash"],
+        "scale": json.loads(headers["scale"]),
+    }
+    return job, regions
+
+
+def finish_task(job, span):
+    detection = job["detection"]
+
+    # Get median height of bboxes
+    with tracer.start_as_current_span(
+        "ocr_detection_height", links=[trace.Link(span.get_span_context())]
+    ):
+        bboxes_heights = []
+        for bbox, text, prob in detection:
+            (top_left, _, bottom_right, _) = bbox
+            bboxes_heights.append(bottom_right[1] - top_left[1])
+        bbox_height = int(np.median(bboxes_heights))
+
+    # Create the final result
+    with tracer.start_as_current_span(
+        "ocr_merge_sentence", links=[trace.Link(span.get_span_context())]
+    ):
+        result = get_sentence(detection)
+
+    bboxes = [box[0] for box in result]
+    texts = [box[1] for box in result]
+    result = {"bboxes": bboxes, "texts": texts, "bbox_height": bbox_height}
+
+    cache.put(job["cache_key"], result, job["phash"])
+
+    publish_result(job["properties"], job["task_id"], result)
+    channel.basic_ack(delivery_tag=job["method"].delivery_tag)
+
+
+def reject(method, e):
+    logger.error(f"Error processing OCR task: {e}")
+    channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+
+
+def process_ocr_batch(messages):
+    """Process a batch of (method, properties, body) messages, each one is acked or rejected on its own."""
+    with tracer.start_as_current_span("ocr-service") as span:
+        span.set_attribute("batch_size", len(messages))
+        groups = {}
+        for method, properties, body in messages:
+            try:
+                job = prepare_task(method, properties, body, span)
+                if job is not None and job["tiled"]:
+                    # Tiled images are read on their own
+                    groups[id(job)] = [job]
+                elif job is not None:
+                    groups.setdefault(job["array"].shape, []).append(job)
+            except Exception as e:
+                reject(method, e)
+
+        for jobs in groups.values():
+            try:
+                with tracer.start_as_current_span(
+                    "ocr_detection", links=[trace.Link(span.get_span_context())]
+                ) as detection_span:
+                    detection_span.set_attribute("batch_size", len(jobs))
+                    detect(jobs)
+            except Exception as e:
+                for job in jobs:
+                    reject(job["method"], e)
+                continue
+
+            for job in jobs:
+                try:
+                    finish_task(job, span)
+                except Exception as e:
+                    reject(job["method"], e)
+
+
+def process_detection_batch(messages):
+    """Detection stage: publish the text regions of each image of a batch of (method, properties, body)."""
+    with tracer.start_as_current_span("ocr-detection-service") as span:
+        span.set_attribute("batch_size", len(messages))
+        for method, properties, body in messages:
+            try:
+                job = prepare_task(method, properties, body, span)
+                if job is None:
+                    continue
+                with tracer.start_as_current_span(
+                    "ocr_detection", links=[trace.Link(span.get_span_context())]
+                ):
+                    if job["tiled"]:
+                        regions = run_tiled(job["array"], detect_tile_regions)
+                    else:
+                        regions = engine.detect_regions(job["array"])
+                publish_regions(job, regions)
+            except Exception as e:
+                reject(method, e)
+
+
+def process_recognition_batch(messages):
+    """Recognition stage: read the text regions of several images at once, then answer each task."""
+    with tracer.start_as_current_span("ocr-recognition-service") as span:
+        span.set_attribute("batch_size", len(messages))
+        jobs = []
+        regions = []
+        for method, properties, body in messages:
+            try:
+                job, job_regions = load_regions(method, properties, body)
+            except Exception as e:
+                reject(method, e)
+                continue
+            job["regions"] = len(job_regions)
+            jobs.append(job)
+            regions.extend(job_regions)
+
+        try:
             with tracer.start_as_current_span(
-                "ocr_merge_sentence", links=[trace.Link(span.get_span_context())]
-            ):
-                result = get_sentence(detection)
-
-            bboxes = [box[0] for box in result]
-            texts = [box[1] for box in result]
-            result = {"bboxes": bboxes, "texts": texts, "bbox_height": bbox_height}
-
-            if len(cache) >= CACHE_SIZE:
-                cache.popitem(last=False)
-            cache[image_hash] = result
-
-            channel.basic_publish(
-                exchange="",
-                routing_key="ocr_results",
-                body=json.dumps({"task_id": task["task_id"], "result": result}),
-            )
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-    except Exception as e:
-        logger.error(f"Error processing OCR task: {e}")
-        channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
-
-
-channel.basic_consume(queue="ocr_tasks", on_message_callback=process_ocr_task)
-logger.info("Waiting for OCR tasks...")
-channel.start_consuming()
+                "ocr_recognition", links=[trace.Link(span.get_span_context())]
+            ) as recognition_span:
+                recognition_span.set_attribute("regions", len(regions))
+                detections = engine.recognize_regions(regions, OCR_RECOGNITION_BATCH_SIZE)
+        except Exception as e:
+            for job in jobs:
+                reject(job["method"], e)
+            return
+
+        end = 0
+        for job in jobs:
+            start, end = end, end + job["regions"]
+            try:
+                job["detection"] = rescale_detection(detections[start:end], *job["scale"])
+                finish_task(job, span)
+            except Exception as e:
+                reject(job["method"], e)
+
+
+STAGES = {
+    "all": ("ocr_tasks", process_ocr_batch),
+    "detect": ("ocr_tasks", process_detection_batch),
+    "recognize": ("ocr_regions", process_recognition_batch),
+}
+
+
+def consume_ocr_tasks():
+    """Collect up to OCR_BATCH_SIZE tasks, waiting at most OCR_BATCH_WAIT_MS after the first one arrived."""
+    queue, process_batch = STAGES[OCR_STAGE]
+    pending = []
+
+    def on_message(ch, method, properties, body):
+        pending.append((method, properties, body))
+
+    channel.basic_qos(prefetch_count=OCR_BATCH_SIZE)
+    channel.basic_consume(queue=queue, on_message_callback=on_message)
+    while True:
+        queue_connection.process_data_events(time_limit=None)
+        deadline = time.monotonic() + OCR_BATCH_WAIT_MS / 1000
+        while len(pending) < OCR_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            queue_connection.process_data_events(time_limit=remaining)
+        if pending:
+            batch = pending[:]
+            pending.clear()
+            process_batch(batch)
+
+
+def serve(worker_index=0):
+    global queue_connection, channel, cache, tile_pool
+
+    if OCR_THREADS_PER_WORKER:
+        torch.set_num_threads(OCR_THREADS_PER_WORKER)
+
+    # Forked before any inference, like the workers, so that the tile processes share the loaded model
+    if OCR_TILE_THRESHOLD and OCR_TILE_PROCESSES and OCR_STAGE != "recognize":
+        tile_pool = multiprocessing.get_context("fork").Pool(OCR_TILE_PROCESSES, initializer=init_tile_process)
+
+        def stop(signum, frame):
+            tile_pool.terminate()
+            os._exit(0)
+
+        signal.signal(signal.SIGTERM, stop)
+
+    # Each worker exposes its own metrics, on consecutive ports
+    start_http_server(METRICS_PORT + worker_index, addr="0.0.0.0")
+
+    disk_cache = None
+    if OCR_CACHE_DIR:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        disk_cache = DiskCache(
+            os.path.join(OCR_CACHE_DIR, "ocr_results.sqlite3"), OCR_CACHE_DISK_BYTES
+        )
+    cache = ResultCache(OCR_CACHE_BYTES, OCR_CACHE_TTL, disk=disk_cache)
+    logger.info(f"Loaded {cache.warm(OCR_CACHE_WARM_ENTRIES)} cached OCR results")
+
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+    queue_connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=RABBITMQ_HOST, credentials=credentials, heartbeat=6000
+        )
+    )
+    channel = queue_connection.channel()
+    logger.info("OCR channel initialized")
+
+    logger.info(f"Waiting for OCR tasks, stage {OCR_STAGE}...")
+    consume_ocr_tasks()
+
+
+if OCR_WORKERS > 1:
+    run_workers(serve, OCR_WORKERS)
+else:
+    serve()
@@ -0,0 +1,45 @@
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+ORIENTATION_TAG = 0x0112
+
+
+def normalize_image(
+    image: Image.Image, max_side: int = 0, grayscale: bool = False, sharpen: bool = False
+) -> tuple[np.ndarray, float, float]:
+    """Prepare an image for text detection.
+
+    The image is put upright according to its EXIF orientation and downscaled so that its long side is at most
+    `max_side` (0 disables resizing). Returns the array easyocr expects (BGR, or single channel when
+    `grayscale`) and the x/y factors mapping its coordinates back to the upright full-size image.
+    """
+    width, height = image.size
+    ratio = max_side / max(width, height) if max_side else 1.0
+    if ratio < 1.0:
+        # Let the JPEG decoder skip the DCT scales we would throw away anyway
+        image.draft("L" if grayscale else "RGB", (int(width * ratio), int(height * ratio)))
+
+    if image.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L" if grayscale else "RGB")
+    if ratio < 1.0:
+        # draft() only decodes at power of two scales, finish the resize to the exact target size
+        image = image.resize((max(1, round(width * ratio)), max(1, round(height * ratio))), Image.BILINEAR)
+    if sharpen:
+        image = image.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
+
+    array = np.asarray(image)
+    if not grayscale:
+        array = np.ascontiguousarray(array[:, :, ::-1])
+    return array, width / image.width, height / image.height
+
+
+def rescale_detection(detection: list, scale_x: float, scale_y: float) -> list:
+    """Map easyocr detections from the normalized image back to original image coordinates."""
+    if scale_x == 1.0 and scale_y == 1.0:
+        return detection
+    return [
+        ([[round(x * scale_x), round(y * scale_y)] for x, y in bbox], text, prob)
+        for bbox, text, prob in detection
+    ]
@@ -0,0 +1,67 @@
+import gc
+import os
+import signal
+import sys
+import time
+
+from loguru import logger
+
+# Workers dying within MIN_UPTIME seconds of their start are restarted after an exponential backoff
+MIN_UPTIME = 30
+MAX_BACKOFF = 60
+
+
+def run_workers(target, n_workers: int) -> None:
+    """Fork `n_workers` processes running `target(worker_index)` and restart the ones that die.
+
+    A worker that keeps dying right after starting, e.g. with RabbitMQ unreachable, is restarted after a delay
+    doubling up to MAX_BACKOFF seconds instead of being forked in a tight loop.
+
+    Everything loaded before the call, the OCR model in particular, is shared copy-on-write with the workers.
+    The parent must not have run inference yet: thread pools created before a fork are unusable in the child.
+    """
+    children = {}
+    started = {}
+    failures = {}
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                target(index)
+            except BaseException as e:
+                logger.exception(f"OCR worker {index} crashed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        logger.info(f"Started OCR worker {index} (pid {pid})")
+        children[pid] = index
+        started[index] = time.monotonic()
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    # Keep garbage collection in the workers from writing to, and so unsharing, the pages of the parent's objects
+    gc.freeze()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(n_workers):
+        spawn(index)
+
+    while True:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is not None:
+            if time.monotonic() - started[index] < MIN_UPTIME:
+                failures[index] = failures.get(index, 0) + 1
+            else:
+                failures[index] = 0
+            delay = min(MAX_BACKOFF, 2 ** failures[index] - 1)
+            logger.error(f"OCR worker {index} exited with status {status}, restarting it in {delay}s")
+            time.sleep(delay)
+            spawn(index)
@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    """Split an image into (x, y, width, height) tiles of at most `tile_size` pixels.
+
+    Neighbouring tiles overlap by at least `overlap` pixels, the tiles are spread evenly so that the last ones end
+    on the image border.
+    """
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        count = math.ceil((length - overlap) / (tile_size - overlap))
+        return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+    return [
+        (x, y, min(tile_size, width - x), min(tile_size, height - y))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def _cores(spans):
+    """Map the start of each (start, end) span of an axis to the part of the axis closer to it than to the
+    neighbouring spans."""
+    spans = sorted(set(spans))
+    cores = {}
+    for i, (start, end) in enumerate(spans):
+        low = (start + spans[i - 1][1]) / 2 if i else -math.inf
+        high = (end + spans[i + 1][0]) / 2 if i + 1 < len(spans) else math.inf
+        cores[start] = (low, high)
+    return cores
+
+
+def merge_tiles(tiles: list, results: list[list], containment: float = 0.5) -> list:
+    """Merge per tile results, (bbox, ...) tuples in tile coordinates, into one list in image coordinates.
+
+    Text in an overlap is found by both tiles: a box is only kept from the tile whose core, the area closer to
+    it than to its neighbours, contains the box center. A word cut by a tile border can still leave a partial
+    box next to the complete one found by the neighbour, boxes lying mostly (`containment` of their area)
+    inside a larger box of another tile are dropped.
+    """
+    x_cores = _cores((x, x + w) for x, _, w, _ in tiles)
+    y_cores = _cores((y, y + h) for _, y, _, h in tiles)
+    merged = []
+    origins = []
+    for index, ((x, y, _, _), items) in enumerate(zip(tiles, results)):
+        (x_low, x_high), (y_low, y_high) = x_cores[x], y_cores[y]
+        for bbox, *rest in items:
+            bbox = [[int(px) + x, int(py) + y] for px, py in bbox]
+            center_x = sum(px for px, _ in bbox) / len(bbox)
+            center_y = sum(py for _, py in bbox) / len(bbox)
+            if x_low <= center_x < x_high and y_low <= center_y < y_high:
+                merged.append((bbox, *rest))
+                origins.append(index)
+    if len(merged) < 2:
+        return merged
+
+    points = np.array([item[0] for item in merged], dtype=np.float64)
+    bounds = np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1)
+    areas = np.maximum(bounds[:, 2] - bounds[:, 0], 1) * np.maximum(bounds[:, 3] - bounds[:, 1], 1)
+    inter_w = np.minimum(bounds[:, None, 2], bounds[None, :, 2]) - np.maximum(bounds[:, None, 0], bounds[None, :, 0])
+    inter_h = np.minimum(bounds[:, None, 3], bounds[None, :, 3]) - np.maximum(bounds[:, None, 1], bounds[None, :, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    origins = np.array(origins)
+    # covered[i, j]: box i lies mostly inside the larger box j found by another tile
+    covered = (
+        (intersection >= containment * areas[:, None])
+        & (areas[:, None] < areas[None, :])
+        & (origins[:, None] != origins[None, :])
+    )
+    return [item for item, drop in zip(merged, covered.any(axis=1)) if not drop]
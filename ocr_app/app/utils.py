@@ -1,96 +1,69 @@
 import numpy as np
 
+DELIMITERS = (".", "!", "?", ":")
+
 
 def get_sentence(raw_result, x_ths=1, y_ths=0.5, mode="ltr"):
-    # create basic attributes
-    box_group = []
-    for box in raw_result:
+    """Merge easyocr word boxes into paragraphs.
+
+    Boxes are put in reading order, top to bottom and then left to right (`ltr`) or right to left (`rtl`)
+    within a line. Paragraphs are then grown greedily in that order: the first box that lies within `x_ths` and
+    `y_ths` mean box heights of the current paragraph joins it, and a joining box ending with a delimiter
+    closes it. Returns a list of [bbox, text] with the 4 corners of each paragraph.
+    """
+    if len(raw_result) == 0:
+        return []
+
+    texts = [box[1] for box in raw_result]
+    bounds = np.empty((len(raw_result), 4), dtype=np.int64)
+    for i, box in enumerate(raw_result):
         all_x = [int(coord[0]) for coord in box[0]]
         all_y = [int(coord[1]) for coord in box[0]]
-        min_x = min(all_x)
-        max_x = max(all_x)
-        min_y = min(all_y)
-        max_y = max(all_y)
-        height = max_y - min_y
-        # last element indicates group
-        box_group.append(
-            [box[1], min_x, max_x, min_y, max_y, height, 0.5 * (min_y + max_y), 0]
-        )
-
-    # arrage order in paragraph
-    arranged_result = []
-    mean_height = np.mean([box[5] for box in box_group])
-    min_gx = min([box[1] for box in box_group])
-    max_gx = max([box[2] for box in box_group])
-    min_gy = min([box[3] for box in box_group])
-    max_gy = max([box[4] for box in box_group])
+        bounds[i] = min(all_x), max(all_x), min(all_y), max(all_y)
 
-    while len(box_group) > 0:
-        highest = min([box[6] for box in box_group])
-        candidates = [box for box in box_group if box[6] < highest + 0.4 * mean_height]
-        # get the far left
-        if mode == "ltr":
-            most_left = min([box[1] for box in candidates])
-            for box in candidates:
-                if box[1] == most_left:
-                    best_box = box
-        elif mode == "rtl":
-            most_right = max([box[2] for box in candidates])
-            for box in candidates:
-                if box[2] == most_right:
-                    best_box = box
-        arranged_result.append(best_box)
-        box_group.remove(best_box)
+    order = _reading_order(bounds, mode)
+    min_x, max_x, min_y, max_y = bounds[order].T
+    heights = max_y - min_y
+    has_delimiter = np.array([texts[i].endswith(DELIMITERS) for i in order])
 
     # cluster boxes into paragraph
-    current_group = 1
-    while len([box for box in arranged_result if box[7] == 0]) > 0:
-        box_group0 = [
-            box for box in arranged_result if box[7] == 0
-        ]  # group0 = non-group
-        # new group
-        if len([box for box in arranged_result if box[7] == current_group]) == 0:
-            box_group0[0][7] = current_group  # assign first box to form new group
-        # try to add group
-        else:
-            current_box_group = [
-                box for box in arranged_result if box[7] == current_group
-            ]
-            mean_height = np.mean([box[5] for box in current_box_group])
-            min_gx = min([box[1] for box in current_box_group]) - x_ths * mean_height
-            max_gx = max([box[2] for box in current_box_group]) + x_ths * mean_height
-            min_gy = min([box[3] for box in current_box_group]) - y_ths * mean_height
-            max_gy = max([box[4] for box in current_box_group]) + y_ths * mean_height
-            add_box = False
-            for box in box_group0:
-                same_horizontal_level = (min_gx <= box[1] <= max_gx) or (
-                    min_gx <= box[2] <= max_gx
-                )
-                same_vertical_level = (min_gy <= box[3] <= max_gy) or (
-                    min_gy <= box[4] <= max_gy
-                )
-                has_delimiter = box[0][-1] in [".", "!", "?", ":"]
-                if same_horizontal_level and same_vertical_level:
-                    box[7] = current_group
-                    add_box = True
-                    break
-            # cannot add more box, go to next group
-            if not add_box or has_delimiter:
-                current_group += 1
-
+    unassigned = np.ones(len(order), dtype=bool)
+    remaining = len(order)
+    first_free = 0
     result = []
-    for i in set(box[7] for box in arranged_result):
-        current_box_group = [box for box in arranged_result if box[7] == i]
-        mean_height = np.mean([box[5] for box in current_box_group])
-        min_gx = min([box[1] for box in current_box_group])
-        max_gx = max([box[2] for box in current_box_group])
-        min_gy = min([box[3] for box in current_box_group])
-        max_gy = max([box[4] for box in current_box_group])
+    while remaining > 0:
+        # new group, formed by the first box not in a group yet
+        while not unassigned[first_free]:
+            first_free += 1
+        members = [first_free]
+        unassigned[first_free] = False
+        remaining -= 1
+        min_gx, max_gx = min_x[first_free], max_x[first_free]
+        min_gy, max_gy = min_y[first_free], max_y[first_free]
+        total_height = int(heights[first_free])
 
-        text = ""
-        for box in current_box_group:
-            text += " " + box[0]
+        # try to add boxes until none fits or the added one ends the sentence
+        while remaining > 0:
+            mean_height = total_height / len(members)
+            low_x, high_x = min_gx - x_ths * mean_height, max_gx + x_ths * mean_height
+            low_y, high_y = min_gy - y_ths * mean_height, max_gy + y_ths * mean_height
+            same_horizontal_level = ((low_x <= min_x) & (min_x <= high_x)) | ((low_x <= max_x) & (max_x <= high_x))
+            same_vertical_level = ((low_y <= min_y) & (min_y <= high_y)) | ((low_y <= max_y) & (max_y <= high_y))
+            fits = unassigned & same_horizontal_level & same_vertical_level
+            i = int(fits.argmax())
+            if not fits[i]:
+                break
+            members.append(i)
+            unassigned[i] = False
+            remaining -= 1
+            min_gx, max_gx = min(min_gx, min_x[i]), max(max_gx, max_x[i])
+            min_gy, max_gy = min(min_gy, min_y[i]), max(max_gy, max_y[i])
+            total_height += int(heights[i])
+            if has_delimiter[i]:
+                break
 
+        members.sort()
+        min_gx, max_gx, min_gy, max_gy = int(min_gx), int(max_gx), int(min_gy), int(max_gy)
         result.append(
             [
                 [
@@ -99,8 +72,42 @@ def get_sentence(raw_result, x_ths=1, y_ths=0.5, mode="ltr"):
                     [max_gx, max_gy],
                     [min_gx, max_gy],
                 ],
-                text[1:],
+                " ".join(texts[order[i]] for i in members),
             ]
         )
 
     return result
+
+
+def _reading_order(bounds, mode):
+    """Return box indices in reading order.
+
+    The next box is picked among the remaining ones whose vertical center is within 0.4 mean box height of the
+    highest one: the leftmost for `ltr`, the rightmost for `rtl`, the last in input order on ties.
+    """
+    min_x, max_x, min_y, max_y = bounds.T
+    line_height = 0.4 * np.mean(max_y - min_y)
+    centers = 0.5 * (min_y + max_y)
+    by_center = np.argsort(centers, kind="stable")
+    sorted_centers = centers[by_center]
+    if mode == "ltr":
+        sort_key = min_x[by_center]
+    elif mode == "rtl":
+        sort_key = -max_x[by_center]
+    else:
+        raise ValueError(f"Unknown reading mode: {mode}")
+
+    alive = np.ones(len(by_center), dtype=bool)
+    first = 0
+    order = []
+    for _ in range(len(by_center)):
+        while not alive[first]:
+            first += 1
+        end = max(first + 1, np.searchsorted(sorted_centers, sorted_centers[first] + line_height, side="left"))
+        candidates = np.flatnonzero(alive[first:end]) + first
+        keys = sort_key[candidates]
+        ties = candidates[keys == keys.min()]
+        best = ties[by_center[ties].argmax()]
+        alive[best] = False
+        order.append(by_center[best])
+    return np.array(order)
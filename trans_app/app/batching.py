@@ -0,0 +1,28 @@
+def bucket_batches(lengths: list[int], max_tokens: int, max_size: int) -> list[list[int]]:
+    """Group indices of inputs into batches of similar length.
+
+    Inputs are sorted by length so that each batch pads to a length close to that of its members, and a batch is
+    closed when it would exceed `max_size` inputs or `max_tokens` tokens once padded. An input longer than
+    `max_tokens` gets a batch of its own.
+    """
+    batches = []
+    batch = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Sorted ascending, so the padded length of the batch is the length of its newest member
+        if batch and (len(batch) >= max_size or (len(batch) + 1) * lengths[i] > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def estimate_tokens(texts: list[str], chars_per_token: float = 4.0) -> int:
+    """Rough token count of texts from their length, cheap enough to size batches before tokenizing."""
+    return sum(int(len(text) / chars_per_token) + 1 for text in texts)
+
+
+def max_new_tokens(source_length: int, length_ratio: float, ceiling: int, margin: int = 8) -> int:
+    """Bound on the length of a translation: proportional to the source with a small margin for short labels."""
+    return min(ceiling, int(source_length * length_ratio) + margin)
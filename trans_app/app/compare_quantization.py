@@ -0,0 +1,63 @@
+"""Compare the float32 and the int8 quantized translation models on a fixed set of sentences.
+
+Usage: python compare_quantization.py [--threads N] [--repeat N]
+"""
+import argparse
+import difflib
+import time
+
+import torch
+
+from translator import TransformersTranslator
+
+MODEL_NAME = "VietAI/envit5-translation"
+SENTENCES = [
+    "Exit",
+    "Open 24 hours",
+    "No smoking",
+    "Please wait to be seated",
+    "Fresh orange juice",
+    "Grilled chicken with rice and vegetables",
+    "Keep this door closed at all times",
+    "Caution: wet floor",
+    "All items on this shelf are 50% off until Sunday",
+    "Emergency exit only, alarm will sound when the door is opened",
+    "The museum is closed on Mondays and public holidays.",
+    "Tickets can be purchased online or at the entrance, children under six enter for free.",
+]
+
+
+def run(translator, repeat):
+    input_ids = translator.encode(SENTENCES)
+    translator.translate_batch(input_ids[:1], max_new_tokens=16)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        translations = translator.translate_batch(input_ids, max_new_tokens=256)
+    return translations, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=0, help="torch threads, 0 keeps the default")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of the sentence set")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    reference, reference_time = run(TransformersTranslator(MODEL_NAME), args.repeat)
+    quantized, quantized_time = run(TransformersTranslator(MODEL_NAME, quantize=True), args.repeat)
+
+    similarities = []
+    for sentence, expected, actual in zip(SENTENCES, reference, quantized):
+        similarity = difflib.SequenceMatcher(None, expected, actual).ratio()
+        similarities.append(similarity)
+        print(f"{similarity:.2f}  {sentence}\n      fp32: {expected}\n      int8: {actual}")
+
+    exact = sum(expected == actual for expected, actual in zip(reference, quantized))
+    speedup = reference_time / quantized_time
+    print(f"\nfp32: {reference_time:.2f}s  int8: {quantized_time:.2f}s  speedup: {speedup:.2f}x")
+    print(f"identical: {exact}/{len(SENTENCES)}  mean similarity: {sum(similarities) / len(similarities):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,39 @@
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 import pika
+import torch
 import json
 from loguru import logger
 import os
+import time
+from opentelemetry import metrics
+from opentelemetry.exporter.prometheus import PrometheusMetricReader
+from opentelemetry.metrics import CallbackOptions, Observation, set_meter_provider
+from opentelemetry.sdk.metrics import MeterProvider
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry import trace
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.trace import get_tracer_provider, set_tracer_provider
+from prometheus_client import start_http_server
+from memory import TranslationMemory, TranslationStore, normalize
+from batching import bucket_batches, estimate_tokens, max_new_tokens
+from translator import create_translator
 
 
 METRIC_SERVICE_NAME = os.getenv("METRIC_SERVICE_NAME")
 METRIC_SERVICE_VERSION = os.getenv("METRIC_SERVICE_VERSION")
 
+# Start Prometheus metrics server
+start_http_server(8099, addr="0.0.0.0")
+resource = Resource(attributes={SERVICE_NAME: METRIC_SERVICE_NAME})
+metric_reader = PrometheusMetricReader()
+provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
+set_meter_provider(provider)
+meter = metrics.get_meter(METRIC_SERVICE_NAME, METRIC_SERVICE_VERSION)
+
 # Setup Jaeger
 JAEGER_AGENT_HOST = os.getenv("JAEGER_AGENT_HOST")
 JAEGER_AGENT_PORT = int(os.getenv("JAEGER_AGENT_PORT"))
-resource = Resource(attributes={SERVICE_NAME: METRIC_SERVICE_NAME})
 set_tracer_provider(TracerProvider(resource=resource))
 tracer = get_tracer_provider().get_tracer(METRIC_SERVICE_NAME, METRIC_SERVICE_VERSION)
 jaeger_exporter = JaegerExporter(
@@ -31,6 +47,54 @@ get_tracer_provider().add_span_processor(span_processor)
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+# Inference backend: transformers (default), onnx or ctranslate2. The onnx and ctranslate2 backends load a model
+# exported to TRANS_MODEL_PATH. With transformers, TRANS_QUANTIZE enables int8 dynamic quantization of the Linear
+# layers, cached in TRANS_MODEL_CACHE_DIR when set.
+TRANS_BACKEND = os.getenv("TRANS_BACKEND", "transformers")
+TRANS_MODEL_PATH = os.getenv("TRANS_MODEL_PATH")
+TRANS_QUANTIZE = os.getenv("TRANS_QUANTIZE", "0") == "1"
+TRANS_MODEL_CACHE_DIR = os.getenv("TRANS_MODEL_CACHE_DIR")
+TRANS_NUM_THREADS = int(os.getenv("TRANS_NUM_THREADS", 0))
+# Maximum number of texts and of padded source tokens of one model.generate call
+TRANS_MAX_BATCH_SIZE = int(os.getenv("TRANS_MAX_BATCH_SIZE", 16))
+TRANS_GENERATE_MAX_TOKENS = int(os.getenv("TRANS_GENERATE_MAX_TOKENS", 1024))
+# Decoding profiles. Translations are bounded to length_ratio times the source tokens, up to max_new_tokens.
+# TRANS_PROFILE picks the default profile and the TRANS_NUM_BEAMS, TRANS_LENGTH_RATIO, TRANS_MAX_NEW_TOKENS and
+# TRANS_EARLY_STOPPING variables override it. Batches pooled from TRANS_FAST_MODE_BACKLOG tasks or more are
+# decoded with the fast profile (0 disables it).
+DECODING_PROFILES = {
+    "quality": {
+        "num_beams": 1,
+        "early_stopping": False,
+        "length_ratio": 2.0,
+        "max_new_tokens": 512,
+    },
+    "fast": {
+        "num_beams": 1,
+        "early_stopping": False,
+        "length_ratio": 1.5,
+        "max_new_tokens": 128,
+    },
+}
+TRANS_PROFILE = os.getenv("TRANS_PROFILE", "quality")
+for key, cast in (
+    ("num_beams", int),
+    ("length_ratio", float),
+    ("max_new_tokens", int),
+    ("early_stopping", lambda value: value == "1"),
+):
+    value = os.getenv(f"TRANS_{key.upper()}")
+    if value is not None:
+        DECODING_PROFILES[TRANS_PROFILE][key] = cast(value)
+TRANS_FAST_MODE_BACKLOG = int(os.getenv("TRANS_FAST_MODE_BACKLOG", 0))
+# Cross-task batching: tasks are pooled up to a number of tasks or of estimated source tokens, or for a maximum wait
+TRANS_MAX_BATCH_TASKS = int(os.getenv("TRANS_MAX_BATCH_TASKS", 8))
+TRANS_MAX_BATCH_TOKENS = int(os.getenv("TRANS_MAX_BATCH_TOKENS", 2048))
+TRANS_BATCH_WAIT_MS = float(os.getenv("TRANS_BATCH_WAIT_MS", 20))
+# Translation memory, with an optional persistent tier on a local volume
+TRANS_MEMORY_BYTES = int(os.getenv("TRANS_MEMORY_BYTES", 32 * 1024 * 1024))
+TRANS_MEMORY_DIR = os.getenv("TRANS_MEMORY_DIR")
+TRANS_MEMORY_DISK_BYTES = int(os.getenv("TRANS_MEMORY_DISK_BYTES", 512 * 1024 * 1024))
 credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
 queue_connection = pika.BlockingConnection(
     pika.ConnectionParameters(
@@ -42,58 +106,215 @@ channel = queue_connection.channel()
 
 # Init model
 model_name = "VietAI/envit5-translation"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+if TRANS_NUM_THREADS:
+    torch.set_num_threads(TRANS_NUM_THREADS)
+if TRANS_BACKEND == "transformers":
+    translator = create_translator(
+        TRANS_BACKEND, model_name, quantize=TRANS_QUANTIZE, cache_dir=TRANS_MODEL_CACHE_DIR
+    )
+else:
+    translator = create_translator(
+        TRANS_BACKEND, model_name, model_path=TRANS_MODEL_PATH, num_threads=TRANS_NUM_THREADS
+    )
 logger.info("Translation model loaded")
 
+store = None
+if TRANS_MEMORY_DIR:
+    os.makedirs(TRANS_MEMORY_DIR, exist_ok=True)
+    # Each backend and weight format translates a little differently, keep their memories apart
+    if TRANS_BACKEND == "transformers":
+        variant = "transformers-int8" if TRANS_QUANTIZE else "transformers"
+    else:
+        variant = f"{TRANS_BACKEND}-{os.path.basename(os.path.normpath(TRANS_MODEL_PATH))}"
+    store = TranslationStore(
+        os.path.join(TRANS_MEMORY_DIR, f"{model_name.replace('/', '--')}-{variant}.sqlite3"),
+        TRANS_MEMORY_DISK_BYTES,
+    )
+memory = TranslationMemory(TRANS_MEMORY_BYTES, store=store)
+deduplicated = 0
+
+
+def observe(get_value):
+    def callback(options: CallbackOptions):
+        yield Observation(get_value())
+
+    return callback
 
-def process_translation_task(ch, method, properties, body):
-    try:
-        with tracer.start_as_current_span("translation-service") as span:
-            with tracer.start_as_current_span(
-                "load_data", links=[trace.Link(span.get_span_context())]
-            ):
-                task = json.loads(body)
-                logger.info(f"Processing translation task: {task['task_id']}")
-
-            translations = []
-
-            with tracer.start_as_current_span(
-                "translation-service-translate",
-                links=[trace.Link(span.get_span_context())],
-            ):
-                for i, input in enumerate(task["texts"]):
-                    eng_input = f"en: {input}"
-                    inputs = tokenizer(
-                        eng_input, return_tensors="pt", padding=True
-                    ).input_ids
-                    outputs = model.generate(inputs, max_length=512)
-                    result = tokenizer.batch_decode(outputs, skip_special_tokens=True)[
-                        0
-                    ]
-                    result = result.replace("vi: ", "")
-                    translations.append(result)
-
-            with tracer.start_as_current_span(
-                "translation-service-publish",
-                links=[trace.Link(span.get_span_context())],
-            ):
-                channel.basic_publish(
-                    exchange="",
-                    routing_key="translation_results",
-                    body=json.dumps(
-                        {"task_id": task["task_id"], "result": translations}
-                    ),
-                )
-                channel.basic_ack(delivery_tag=method.delivery_tag)
-    except Exception as e:
-        logger.error(f"Error processing translation task: {e}")
-        channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
-
-
-channel.basic_consume(
-    queue="translation_tasks", on_message_callback=process_translation_task
+
+meter.create_observable_counter(
+    name="translation_memory_hits",
+    callbacks=[observe(lambda: memory.hits + memory.store_hits)],
+    description="Texts served by the translation memory",
+)
+meter.create_observable_counter(
+    name="translation_memory_misses",
+    callbacks=[observe(lambda: memory.misses)],
+    description="Texts sent to the model",
+)
+meter.create_observable_counter(
+    name="translation_memory_deduplicated",
+    callbacks=[observe(lambda: deduplicated)],
+    description="Repeated texts of a batch translated only once",
 )
+meter.create_observable_gauge(
+    name="translation_memory_hit_ratio",
+    callbacks=[observe(lambda: memory.hit_ratio)],
+    description="Share of distinct texts served by the translation memory",
+)
+
+real_tokens_counter = meter.create_counter(
+    name="translation_real_tokens",
+    description="Source tokens sent to the model",
+)
+padding_tokens_counter = meter.create_counter(
+    name="translation_padding_tokens",
+    description="Padding tokens added to batch source texts to the same length",
+)
+
+
+def translate(texts, profile_name):
+    """Translate texts with a decoding profile, in order.
+
+    Repeated texts are translated once and known ones come from the translation memory, only the rest goes to
+    the model. Only translations decoded with the default profile are remembered, so the memory never serves a
+    degraded translation once the backlog is gone.
+    """
+    global deduplicated
+
+    keys = [normalize(text) for text in texts]
+    unique_keys = list(dict.fromkeys(keys))
+    deduplicated += len(keys) - len(unique_keys)
+    translations = {}
+    missing = []
+    for key in unique_keys:
+        translation = memory.get(key)
+        if translation is None:
+            missing.append(key)
+        else:
+            translations[key] = translation
+
+    for key, translation in zip(missing, generate(missing, DECODING_PROFILES[profile_name])):
+        translations[key] = translation
+        if profile_name == TRANS_PROFILE:
+            memory.put(key, translation)
+    return [translations[key] for key in keys]
+
+
+def generate(texts, profile):
+    """Translate texts with the model, in order.
+
+    Texts are bucketed by token length into batches of at most TRANS_MAX_BATCH_SIZE texts and
+    TRANS_GENERATE_MAX_TOKENS padded tokens, so little compute is spent on padding. The length of the
+    translations is bounded by the longest source of each batch.
+    """
+    if not texts:
+        return []
+    input_ids = translator.encode(texts)
+    lengths = [len(ids) for ids in input_ids]
+    translations = [None] * len(texts)
+    for batch in bucket_batches(lengths, TRANS_GENERATE_MAX_TOKENS, TRANS_MAX_BATCH_SIZE):
+        # Sorted by length, the last text of the batch is the longest one
+        padded_length = lengths[batch[-1]]
+        real_tokens = sum(lengths[i] for i in batch)
+        real_tokens_counter.add(real_tokens)
+        padding_tokens_counter.add(padded_length * len(batch) - real_tokens)
+        results = translator.translate_batch(
+            [input_ids[i] for i in batch],
+            num_beams=profile["num_beams"],
+            early_stopping=profile["early_stopping"],
+            max_new_tokens=max_new_tokens(
+                padded_length, profile["length_ratio"], profile["max_new_tokens"]
+            ),
+        )
+        for i, result in zip(batch, results):
+            translations[i] = result
+    return translations
+
+
+def reject(method, e):
+    logger.error(f"Error processing translation task: {e}")
+    channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+
+
+def process_translation_batch(tasks):
+    """Translate the texts of several (method, properties, task) in one pass, then answer each task."""
+    with tracer.start_as_current_span("translation-service") as span:
+        span.set_attribute("batch_size", len(tasks))
+        profile_name = TRANS_PROFILE
+        if TRANS_FAST_MODE_BACKLOG and len(tasks) >= TRANS_FAST_MODE_BACKLOG:
+            profile_name = "fast"
+        span.set_attribute("decoding_profile", profile_name)
+        with tracer.start_as_current_span(
+            "translation-service-translate",
+            links=[trace.Link(span.get_span_context())],
+        ):
+            texts = [text for _, _, task in tasks for text in task["texts"]]
+            try:
+                translations = translate(texts, profile_name)
+            except Exception as e:
+                for method, _, _ in tasks:
+                    reject(method, e)
+                return
+
+        with tracer.start_as_current_span(
+            "translation-service-publish",
+            links=[trace.Link(span.get_span_context())],
+        ):
+            end = 0
+            for method, properties, task in tasks:
+                start, end = end, end + len(task["texts"])
+                result = translations[start:end]
+                try:
+                    channel.basic_publish(
+                        exchange="",
+                        routing_key=properties.reply_to or "translation_results",
+                        properties=pika.BasicProperties(
+                            correlation_id=properties.correlation_id or task["task_id"]
+                        ),
+                        body=json.dumps({"task_id": task["task_id"], "result": result}),
+                    )
+                    channel.basic_ack(delivery_tag=method.delivery_tag)
+                except Exception as e:
+                    reject(method, e)
+
+
+def consume_translation_tasks():
+    """Pool prefetched tasks until TRANS_MAX_BATCH_TOKENS source tokens or TRANS_MAX_BATCH_TASKS tasks are
+    waiting, or TRANS_BATCH_WAIT_MS passed since the first one arrived."""
+    pending = []
+    pending_tokens = 0
+
+    def on_message(ch, method, properties, body):
+        nonlocal pending_tokens
+        try:
+            task = json.loads(body)
+            logger.info(f"Processing translation task: {task['task_id']}")
+            # Estimated: texts are only tokenized once they miss the translation memory
+            pending_tokens += estimate_tokens(task["texts"])
+        except Exception as e:
+            reject(method, e)
+            return
+        pending.append((method, properties, task))
+
+    def batch_full():
+        return len(pending) >= TRANS_MAX_BATCH_TASKS or pending_tokens >= TRANS_MAX_BATCH_TOKENS
+
+    channel.basic_qos(prefetch_count=TRANS_MAX_BATCH_TASKS)
+    channel.basic_consume(queue="translation_tasks", on_message_callback=on_message)
+    while True:
+        queue_connection.process_data_events(time_limit=None)
+        deadline = time.monotonic() + TRANS_BATCH_WAIT_MS / 1000
+        while not batch_full():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            queue_connection.process_data_events(time_limit=remaining)
+        if pending:
+            batch = pending[:]
+            pending.clear()
+            pending_tokens = 0
+            process_translation_batch(batch)
+
 
 logger.info("Waiting for translation tasks...")
-channel.start_consuming()
+consume_translation_tasks()
@@ -0,0 +1,146 @@
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize(text: str) -> str:
+    """Key of a text in the translation memory: NFC form with whitespace runs collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class TranslationMemory:
+    """LRU of translations keyed by normalized source text, bounded by the size of the stored strings.
+
+    An optional `TranslationStore` keeps translations across restarts, misses fall through to it and its hits
+    are promoted back into memory.
+    """
+
+    def __init__(self, max_bytes: int, store: "TranslationStore" = None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.size = 0
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.store_hits + self.misses
+        return (self.hits + self.store_hits) / lookups if lookups else 0.0
+
+    def get(self, key: str):
+        translation = self._entries.get(key)
+        if translation is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self.store is not None:
+                self.store.touch(key)
+            return translation
+        if self.store is not None:
+            translation = self.store.get(key)
+            if translation is not None:
+                self.store_hits += 1
+                self.put(key, translation, persist=False)
+                return translation
+        self.misses += 1
+        return None
+
+    def put(self, key: str, translation: str, persist: bool = True) -> None:
+        if persist and self.store is not None:
+            self.store.put(key, translation)
+        size = len(key.encode("utf-8")) + len(translation.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = translation
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        translation = self._entries.pop(key)
+        self.size -= len(key.encode("utf-8")) + len(translation.encode("utf-8"))
+
+
+class TranslationStore:
+    """SQLite store of translations, the least recently used ones are deleted beyond `max_bytes`.
+
+    Hits served from memory are recorded with `touch` and written in batches, every FLUSH_HITS hits or
+    FLUSH_SECONDS seconds.
+    """
+
+    EVICTION_BATCH = 256
+    FLUSH_HITS = 256
+    FLUSH_SECONDS = 10.0
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        # key -> last access not written yet
+        self._touched: dict[str, float] = {}
+        self._touched_hits = 0
+        self._flushed = time.monotonic()
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS translations_last_access ON translations (last_access)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    def get(self, key: str):
+        row = self.db.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE translations SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def touch(self, key: str) -> None:
+        """Record a hit on a translation served from memory."""
+        self._touched[key] = time.time()
+        self._touched_hits += 1
+        if self._touched_hits >= self.FLUSH_HITS or time.monotonic() - self._flushed >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._touched:
+            self.db.executemany(
+                "UPDATE translations SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(last_access, key) for key, last_access in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touched_hits = 0
+        self._flushed = time.monotonic()
+
+    def put(self, key: str, translation: str) -> None:
+        size = len(key.encode("utf-8")) + len(translation.encode("utf-8"))
+        # Evict by up to date access times
+        self.flush()
+        row = self.db.execute("SELECT size FROM translations WHERE key = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO translations (key, translation, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, translation, size, time.time()),
+        )
+        self.size += size - (row[0] if row is not None else 0)
+        while self.size > self.max_bytes:
+            oldest = self.db.execute(
+                "SELECT key, size FROM translations ORDER BY last_access LIMIT ?", (self.EVICTION_BATCH,)
+            ).fetchall()
+            if not oldest:
+                break
+            evicted = []
+            for k, size in oldest:
+                evicted.append((k,))
+                self.size -= size
+                if self.size <= self.max_bytes:
+                    break
+            self.db.executemany("DELETE FROM translations WHERE key = ?", evicted)
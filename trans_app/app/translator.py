@@ -0,0 +1,135 @@
+import os
+from abc import ABC, abstractmethod
+
+import torch
+import transformers
+from loguru import logger
+from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer, GenerationConfig
+
+
+class Translator(ABC):
+    """Inference backend of the translation worker.
+
+    Texts are tokenized with `encode` so that the worker can bucket them by length, then translated one batch of
+    token ids at a time. Batching, the translation memory and the metrics live in the worker and are shared by
+    every backend. Decoding options are `num_beams`, `early_stopping` and `max_new_tokens`.
+    """
+
+    def __init__(self, model_name: str):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def encode(self, texts: list[str]) -> list[list[int]]:
+        return self.tokenizer([f"en: {text}" for text in texts]).input_ids
+
+    @abstractmethod
+    def translate_batch(self, input_ids: list[list[int]], **decoding) -> list[str]:
+        """Translate one batch of token ids from `encode`."""
+
+    def translate(self, texts: list[str], **decoding) -> list[str]:
+        return self.translate_batch(self.encode(texts), **decoding)
+
+    def decode(self, outputs) -> list[str]:
+        results = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        return [result.replace("vi: ", "") for result in results]
+
+
+class GenerateTranslator(Translator):
+    """Backend whose `model` has the transformers `generate` API, given padded PyTorch tensors."""
+
+    def translate_batch(self, input_ids, **decoding):
+        inputs = self.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+        with torch.inference_mode():
+            outputs = self.model.generate(**inputs, **decoding)
+        return self.decode(outputs)
+
+
+def quantize_linear(model):
+    """Replace the Linear layers of a model by int8 dynamically quantized ones."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TransformersTranslator(GenerateTranslator):
+    """PyTorch model from transformers, with `quantize` the Linear layers are replaced by int8 dynamically
+    quantized ones. When `cache_dir` is set the quantized weights are saved there, and the next starts build the
+    model from its config and load them instead of reading the float32 checkpoint. The cached weights are only
+    valid for the torch and transformers versions that produced them, both are part of the file name."""
+
+    def __init__(self, model_name: str, quantize: bool = False, cache_dir: str = None):
+        super().__init__(model_name)
+        self.model = self.load_model(model_name, quantize, cache_dir)
+
+    @staticmethod
+    def load_model(model_name, quantize, cache_dir):
+        if not quantize:
+            return AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+
+        path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            versions = f"torch{torch.__version__}-transformers{transformers.__version__}"
+            path = os.path.join(cache_dir, f"{model_name.replace('/', '--')}-int8-{versions}.pt")
+            if os.path.exists(path):
+                logger.info(f"Loading quantized weights from {path}")
+                # The module structure is rebuilt from the code, only tensors are read back from the cache
+                model = quantize_linear(AutoModelForSeq2SeqLM.from_config(AutoConfig.from_pretrained(model_name)))
+                model.load_state_dict(torch.load(path, weights_only=True))
+                try:
+                    model.generation_config = GenerationConfig.from_pretrained(model_name)
+                except OSError:
+                    # No generation_config.json, from_config already derived it from the model config
+                    pass
+                return model.eval()
+
+        model = quantize_linear(AutoModelForSeq2SeqLM.from_pretrained(model_name).eval())
+        if path:
+            torch.save(model.state_dict(), path)
+            logger.info(f"Saved quantized weights to {path}")
+        return model
+
+
+class OnnxTranslator(GenerateTranslator):
+    """ONNX Runtime model exported with `optimum-cli export onnx --model <model_name> <model_path>`."""
+
+    def __init__(self, model_name: str, model_path: str, num_threads: int = 0):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        super().__init__(model_name)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.model = ORTModelForSeq2SeqLM.from_pretrained(model_path, session_options=options)
+
+
+class CTranslate2Translator(Translator):
+    """CTranslate2 model converted with `ct2-transformers-converter --model <model_name> --output_dir
+    <model_path>`, optionally with `--quantization int8`."""
+
+    def __init__(self, model_name: str, model_path: str, num_threads: int = 0):
+        import ctranslate2
+
+        super().__init__(model_name)
+        self.model = ctranslate2.Translator(model_path, device="cpu", intra_threads=num_threads)
+
+    def translate_batch(self, input_ids, num_beams=1, early_stopping=False, max_new_tokens=512):
+        # CTranslate2 always stops a hypothesis at the end token, early_stopping has no equivalent
+        results = self.model.translate_batch(
+            [self.tokenizer.convert_ids_to_tokens(ids) for ids in input_ids],
+            beam_size=num_beams,
+            max_decoding_length=max_new_tokens,
+        )
+        return self.decode([self.tokenizer.convert_tokens_to_ids(result.hypotheses[0]) for result in results])
+
+
+BACKENDS = {
+    "transformers": TransformersTranslator,
+    "onnx": OnnxTranslator,
+    "ctranslate2": CTranslate2Translator,
+}
+
+
+def create_translator(backend: str, model_name: str, **options) -> Translator:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown translation backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    logger.info(f"Loading {model_name} with the {backend} backend")
+    return BACKENDS[backend](model_name, **options)
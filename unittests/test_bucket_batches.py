@@ -0,0 +1,20 @@
+from trans_app.app.batching import bucket_batches, estimate_tokens, max_new_tokens
+
+
+def test_bucket_batches():
+    lengths = [30, 5, 6, 29, 7, 100]
+    batches = bucket_batches(lengths, max_tokens=64, max_size=3)
+    assert batches == [[1, 2, 4], [3, 0], [5]]
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches[:-1]:
+        assert len(batch) * max(lengths[i] for i in batch) <= 64
+
+
+def test_max_new_tokens():
+    assert max_new_tokens(3, length_ratio=2.0, ceiling=512) == 14
+    assert max_new_tokens(400, length_ratio=2.0, ceiling=512) == 512
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([]) == 0
+    assert estimate_tokens(["Exit", "Please wait to be seated"]) == 2 + 7
@@ -1,8 +1,7 @@
 import os
-import numpy as np
 from PIL import Image, ImageFont
 
-from lens.app.utils import draw_results
+from lens.app.utils import draw_results, encode_image, fit_text, line_height, load_font, wrap
 
 
 def test_draw_results():
@@ -13,4 +12,39 @@ def test_draw_results():
     texts = ["Hello World"]
     font = ImageFont.truetype(font_path, 16)
     result = draw_results(img_pil, bboxes, texts, font)
-    assert isinstance(result, np.ndarray)
+    assert result is img_pil
+
+
+def test_fonts_are_loaded_once():
+    font_path = os.path.join(os.path.dirname(__file__), "../lens/app/BeVietnam-Light.ttf")
+    font = load_font(font_path, 16)
+    assert load_font(font_path, 16) is font
+    assert load_font(font_path, 20) is not font
+    assert line_height(font_path, 16) < line_height(font_path, 20)
+
+
+def test_text_is_fitted_inside_its_box():
+    font_path = os.path.join(os.path.dirname(__file__), "../lens/app/BeVietnam-Light.ttf")
+    text = "Vui lòng xếp hàng và chờ đến lượt của bạn trước quầy thanh toán"
+    size, lines = fit_text(text, 200, 60, font_path, 40)
+    assert " ".join(lines) == text
+    assert len(lines) * line_height(font_path, size) <= 60
+    assert all(load_font(font_path, size).getlength(line) <= 200 for line in lines)
+    # The size is the largest one that fits
+    assert size < 40
+    larger = wrap(text.split(), font_path, size + 1, 200)
+    assert larger is None or len(larger) * line_height(font_path, size + 1) > 60
+
+
+def test_short_text_keeps_the_largest_size():
+    font_path = os.path.join(os.path.dirname(__file__), "../lens/app/BeVietnam-Light.ttf")
+    assert fit_text("Lối ra", 400, 100, font_path, 24) == (24, ["Lối ra"])
+
+
+def test_encode_image():
+    image = Image.new("RGBA", (64, 32), "red")
+    for output_format, pil_format in (("jpeg", "JPEG"), ("webp", "WEBP"), ("png", "PNG")):
+        decoded = Image.open(encode_image(image, output_format, quality=80))
+        assert decoded.format == pil_format
+        assert decoded.size == (64, 32)
+        assert decoded.convert("RGB").getpixel((32, 16))[0] > 200
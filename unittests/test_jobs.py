@@ -0,0 +1,53 @@
+import asyncio
+
+from lens.app.jobs import JobStore
+
+
+def test_job_lifecycle():
+    jobs = JobStore(ttl=60)
+    job = jobs.create()
+    assert jobs.get(job.id) is job
+    assert job.status == "queued"
+    jobs.update(job, "ocr_done")
+    jobs.finish(job, {"texts": []}, "application/json")
+    assert jobs.get(job.id).status == "done"
+    assert job.result == {"texts": []}
+    assert jobs.get("unknown") is None
+
+
+def test_failed_job():
+    jobs = JobStore(ttl=60)
+    job = jobs.create()
+    jobs.finish(job, None)
+    assert job.status == "failed"
+
+
+def test_finished_jobs_expire():
+    jobs = JobStore(ttl=0)
+    running = jobs.create()
+    finished = jobs.create()
+    jobs.finish(finished, b"image", "image/jpeg")
+    assert jobs.get(finished.id) is None
+    # Jobs still running never expire
+    assert jobs.get(running.id) is running
+    assert len(jobs) == 1
+
+
+def test_events_follow_the_job_until_it_finishes():
+    jobs = JobStore(ttl=60)
+    job = jobs.create()
+
+    async def follow():
+        return [state["status"] async for state in jobs.events(job)]
+
+    async def run():
+        events = asyncio.create_task(follow())
+        await asyncio.sleep(0)
+        for status in ("ocr_done", "translated", "rendered"):
+            jobs.update(job, status)
+            await asyncio.sleep(0)
+        jobs.finish(job, b"image", "image/jpeg")
+        return await events
+
+    assert asyncio.run(run()) == ["queued", "ocr_done", "translated", "rendered", "done"]
+    assert job.subscribers == []
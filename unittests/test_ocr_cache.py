@@ -0,0 +1,77 @@
+import json
+
+from ocr_app.app.cache import DiskCache, ResultCache
+
+
+def test_result_cache_lru_byte_budget():
+    result = {"bboxes": [], "texts": ["Hello"], "bbox_height": 10}
+    cache = ResultCache(max_bytes=3 * len('{"bboxes": [], "texts": ["Hello"], "bbox_height": 10}'))
+    keys = [ResultCache.key(bytes([i])) for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, result)
+    assert cache.get(keys[0]) == result  # promote the oldest entry
+    cache.put(keys[3], result)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == result
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 1, 1)
+
+
+def test_result_cache_phash_index():
+    cache = ResultCache(max_bytes=1024)
+    cache.put("a", {"texts": ["Hello"]}, phash="ffff:10x10")
+    assert cache.get("b") is None
+    assert cache.get_similar("ffff:10x10") == {"texts": ["Hello"]}
+    assert cache.get_similar("0000:10x10") is None
+    assert (cache.hits, cache.similar_hits, cache.misses) == (0, 1, 1)
+
+
+def test_result_cache_disk_tier(tmp_path):
+    path = str(tmp_path / "ocr_results.sqlite3")
+    cache = ResultCache(max_bytes=1024, disk=DiskCache(path, max_bytes=1024))
+    cache.put("a", {"texts": ["Hello"]})
+    cache.put("b", {"texts": ["World"]})
+    assert cache.get("b") == {"texts": ["World"]}
+
+    # A restarted worker serves both results from disk and warms the hottest one first
+    restarted = ResultCache(max_bytes=1024, disk=DiskCache(path, max_bytes=1024))
+    assert restarted.warm(1) == 1
+    assert restarted.get("b") == {"texts": ["World"]}
+    assert restarted.get("a") == {"texts": ["Hello"]}
+    assert (restarted.hits, restarted.disk_hits, restarted.misses) == (1, 1, 0)
+
+
+def test_memory_hits_keep_results_hot_on_disk(tmp_path):
+    path = str(tmp_path / "ocr_results.sqlite3")
+    result = {"texts": ["Hello"]}
+    size = len(json.dumps(result))
+    cache = ResultCache(max_bytes=1024, disk=DiskCache(path, max_bytes=3 * size))
+    cache.put("hot", result)
+    for _ in range(1000):
+        assert cache.get("hot") == result
+    for key in ("a", "b", "c"):
+        cache.put(key, result)
+
+    # The oldest result read from disk is evicted, not the one hit in memory
+    disk = DiskCache(path, max_bytes=3 * size)
+    assert disk.get("hot") == result
+    assert disk.get("a") is None
+    assert disk.db.execute("SELECT hits FROM results WHERE key = 'hot'").fetchone()[0] == 1001
+    restarted = ResultCache(max_bytes=1024, disk=disk)
+    assert restarted.warm(1) == 1
+    assert restarted.get("hot") == result
+    assert restarted.hits == 1
+
+
+def test_disk_budget_is_shared_by_processes(tmp_path):
+    path = str(tmp_path / "ocr_results.sqlite3")
+    result = {"texts": ["Hello"]}
+    size = len(json.dumps(result))
+    # Two workers sharing the volume, each writing its own results
+    workers = [DiskCache(path, max_bytes=4 * size) for _ in range(2)]
+    for i in range(8):
+        workers[i % 2].put(str(i), result)
+
+    assert workers[0].size == workers[1].size == 4 * size
+    count = workers[0].db.execute("SELECT COUNT(*), SUM(size) FROM results").fetchone()
+    assert count == (4, 4 * size)
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+MODEL_DIR = os.path.join(ROOT, "ocr_app", "app", "models")
+ONNX_DIR = os.getenv("OCR_ONNX_DIR", os.path.join(MODEL_DIR, "onnx"))
+
+
+class Node:
+    def __init__(self, name):
+        self.name = name
+
+
+class StubSession:
+    """InferenceSession answering with its feeds, in input order."""
+
+    def __init__(self, *input_names):
+        self.input_names = input_names
+
+    def get_inputs(self):
+        return [Node(name) for name in self.input_names]
+
+    def run(self, output_names, feeds):
+        assert list(feeds) == list(self.input_names)
+        return [value * 2 for value in feeds.values()]
+
+
+def test_unknown_engine():
+    from ocr_app.app.engine import create_engine
+
+    with pytest.raises(ValueError):
+        create_engine("tesseract")
+
+
+def test_onnx_session_feeds_the_graph_inputs():
+    from ocr_app.app.engine import OnnxSession
+
+    image, text = np.ones((1, 3, 4, 4), np.float32), np.zeros((1, 2), np.int64)
+    detector = OnnxSession("craft.onnx", wrap=np.ascontiguousarray)
+    detector.session = StubSession("image", "score")
+    outputs = detector(image, text)
+    assert isinstance(outputs, tuple) and len(outputs) == 2
+    np.testing.assert_array_equal(outputs[1], text * 2)
+
+    # The export of the recognizer has no text input: it is dropped and the single output is not a tuple
+    recognizer = OnnxSession("recognizer.onnx")
+    recognizer.session = StubSession("image")
+    np.testing.assert_array_equal(recognizer(image, text), image * 2)
+
+
+@pytest.mark.skipif(
+    os.getenv("OCR_CONFORMANCE") != "1",
+    reason="manual: needs easyocr, onnxruntime and an ONNX export, run with OCR_CONFORMANCE=1",
+)
+def test_engines_feed_get_sentence_identically():
+    pytest.importorskip("easyocr")
+    pytest.importorskip("onnxruntime")
+    from ocr_app.app.engine import DETECTOR_FILE, RECOGNIZER_FILE, create_engine
+    from ocr_app.app.utils import get_sentence
+
+    if not all(os.path.exists(os.path.join(ONNX_DIR, name)) for name in (DETECTOR_FILE, RECOGNIZER_FILE)):
+        pytest.skip(f"no ONNX export in {ONNX_DIR}, run ocr_app/app/export_onnx.py")
+
+    image = np.asarray(Image.open(os.path.join(ROOT, "images", "example.jpeg")).convert("RGB"))[:, :, ::-1]
+    image = np.ascontiguousarray(image)
+    expected = get_sentence(create_engine("easyocr", model_dir=MODEL_DIR, quantize=False).readtext(image))
+    actual = get_sentence(create_engine("onnx", model_dir=MODEL_DIR, onnx_dir=ONNX_DIR).readtext(image))
+
+    assert [text for _, text in actual] == [text for _, text in expected]
+    for (actual_bbox, _), (expected_bbox, _) in zip(actual, expected):
+        np.testing.assert_allclose(actual_bbox, expected_bbox, atol=2)
@@ -0,0 +1,21 @@
+from PIL import Image
+
+from ocr_app.app.preprocess import normalize_image, rescale_detection
+
+
+def test_normalize_image_back_projection():
+    img_pil = Image.new("RGB", (4000, 3000), "white")
+    array, scale_x, scale_y = normalize_image(img_pil, max_side=1000)
+    assert array.shape == (750, 1000, 3)
+
+    detection = [([[10, 20], [110, 20], [110, 70], [10, 70]], "Hello", 0.9)]
+    bbox, text, prob = rescale_detection(detection, scale_x, scale_y)[0]
+    assert bbox == [[40, 80], [440, 80], [440, 280], [40, 280]]
+    assert (text, prob) == ("Hello", 0.9)
+
+
+def test_normalize_image_grayscale():
+    img_pil = Image.new("RGB", (200, 100), "white")
+    array, scale_x, scale_y = normalize_image(img_pil, max_side=1000, grayscale=True, sharpen=True)
+    assert array.shape == (100, 200)
+    assert (scale_x, scale_y) == (1.0, 1.0)
@@ -0,0 +1,43 @@
+from ocr_app.app.tiling import merge_tiles, tile_grid
+
+
+def box(x, y, w, h):
+    return [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+
+
+def test_small_image_is_one_tile():
+    assert tile_grid(800, 600, 1024, 128) == [(0, 0, 800, 600)]
+
+
+def test_tiles_cover_the_image_with_overlap():
+    tiles = tile_grid(5000, 2500, 1024, 128)
+    xs = sorted({x for x, _, _, _ in tiles})
+    ys = sorted({y for _, y, _, _ in tiles})
+    assert len(tiles) == len(xs) * len(ys)
+    assert all(w <= 1024 and h <= 1024 for _, _, w, h in tiles)
+    assert xs[0] == 0 and xs[-1] + 1024 == 5000
+    assert ys[0] == 0 and ys[-1] + 1024 == 2500
+    for starts in (xs, ys):
+        for previous, current in zip(starts, starts[1:]):
+            assert previous + 1024 - current >= 128
+
+
+def test_merge_moves_boxes_to_image_coordinates():
+    tiles = tile_grid(2000, 1000, 1024, 128)
+    results = [[(box(10, 20, 100, 30), "left", 0.9)], [(box(500, 20, 100, 30), "right", 0.8)]]
+    merged = merge_tiles(tiles, results)
+    assert merged == [(box(10, 20, 100, 30), "left", 0.9), (box(tiles[1][0] + 500, 20, 100, 30), "right", 0.8)]
+
+
+def test_merge_keeps_one_copy_of_text_in_the_overlap():
+    tiles = [(0, 0, 1000, 500), (900, 0, 1000, 500)]
+    # The same word seen by both tiles, at x = 930 in image coordinates
+    results = [[(box(930, 100, 40, 20), "word", 0.9)], [(box(30, 100, 40, 20), "word", 0.9)]]
+    assert merge_tiles(tiles, results) == [(box(930, 100, 40, 20), "word", 0.9)]
+
+
+def test_merge_drops_partial_box_cut_by_the_tile_border():
+    tiles = [(0, 0, 1000, 500), (900, 0, 1000, 500)]
+    # A word spanning x = 880 to 1100: the first tile sees it up to its border, the second one from x = 900
+    results = [[(box(880, 100, 120, 20), "seasi", 0.6)], [(box(0, 100, 200, 20), "easide", 0.8)]]
+    assert merge_tiles(tiles, results) == [(box(900, 100, 200, 20), "easide", 0.8)]
@@ -0,0 +1,34 @@
+from trans_app.app.memory import TranslationMemory, TranslationStore, normalize
+
+
+def test_normalize():
+    assert normalize("  Open\t24   hours\n") == "Open 24 hours"
+
+
+def test_translation_memory_store(tmp_path):
+    path = str(tmp_path / "translations.sqlite3")
+    memory = TranslationMemory(max_bytes=1024, store=TranslationStore(path, max_bytes=1024))
+    assert memory.get("Exit") is None
+    memory.put("Exit", "Lối ra")
+    assert memory.get("Exit") == "Lối ra"
+
+    restarted = TranslationMemory(max_bytes=1024, store=TranslationStore(path, max_bytes=1024))
+    assert restarted.get("Exit") == "Lối ra"
+    assert restarted.get("Exit") == "Lối ra"
+    assert (restarted.hits, restarted.store_hits, restarted.misses) == (1, 1, 0)
+    assert memory.hit_ratio == 0.5
+
+
+def test_memory_hits_keep_translations_in_the_store(tmp_path):
+    path = str(tmp_path / "translations.sqlite3")
+    # Room for two of the three translations
+    store = TranslationStore(path, max_bytes=30)
+    memory = TranslationMemory(max_bytes=1024, store=store)
+    memory.put("Exit", "Lối ra")
+    memory.put("Open", "Mở cửa")
+    assert memory.get("Exit") == "Lối ra"  # served from memory
+    memory.put("Push", "Đẩy vào")
+
+    restarted = TranslationStore(path, max_bytes=store.max_bytes)
+    assert restarted.get("Exit") == "Lối ra"
+    assert restarted.get("Open") is None
@@ -0,0 +1,25 @@
+import pytest
+
+
+def test_quantized_weights_round_trip(tmp_path):
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    from trans_app.app.translator import quantize_linear
+
+    config = transformers.T5Config(
+        vocab_size=64, d_model=16, d_kv=4, d_ff=32, num_layers=1, num_heads=2, decoder_start_token_id=0
+    )
+    model = quantize_linear(transformers.T5ForConditionalGeneration(config).eval())
+    path = str(tmp_path / "t5-int8.pt")
+    torch.save(model.state_dict(), path)
+
+    # A model built from the config has other random weights until the cached ones are loaded
+    restored = quantize_linear(transformers.T5ForConditionalGeneration(config).eval())
+    restored.load_state_dict(torch.load(path, weights_only=True))
+
+    input_ids = torch.tensor([[5, 6, 7, 1]])
+    decoder_input_ids = torch.tensor([[0, 3]])
+    with torch.inference_mode():
+        expected = model(input_ids=input_ids, decoder_input_ids=decoder_input_ids).logits
+        actual = restored(input_ids=input_ids, decoder_input_ids=decoder_input_ids).logits
+    assert torch.equal(actual, expected)